@@ -43,6 +43,8 @@ class ArubaEdgeSimulator:
             self.config.get('pcai_agent_trigger_endpoint')
         )
         self.is_alert_active = False 
+        # Reused for every trigger so the connection to the PCAI Agent stays open between anomalies.
+        self.http_session = requests.Session()
 
         opsramp_cfg = full_cfg.get('pcai_app', {}).get('opsramp', {})
         connector = OpsRampConnector(opsramp_config=opsramp_cfg, pcai_agent_id=self.device_id)
@@ -61,7 +63,7 @@ class ArubaEdgeSimulator:
         logger.info(f"--- MAKING ACTUAL HTTP API CALL [{method}] ---")
         logger.info(f"To Endpoint: {endpoint}")
         try:
-            response = requests.post(endpoint, json=payload, timeout=60) 
+            response = self.http_session.post(endpoint, json=payload, timeout=(5, 60))
             response.raise_for_status() 
             logger.info(f"SUCCESS: API Call to {endpoint}. Status: {response.status_code}")
         except requests.exceptions.RequestException as e:
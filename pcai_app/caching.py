@@ -0,0 +1,199 @@
+# pcai_app/caching.py
+
+import math
+import threading
+import time
+import logging
+from collections import OrderedDict, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Sensor readings that make up the similarity vector, each with a nominal scale so that
+# no single unit (e.g. Hz vs g) dominates the cosine distance. Both the edge payload keys
+# (temperature, acoustic) and the richer ThingsBoard-style keys are covered.
+SEMANTIC_FEATURES = (
+    ("temperature", 50.0),
+    ("acoustic", 30.0),
+    ("temperature_c", 50.0),
+    ("temperature_increase_c", 5.0),
+    ("vibration_overall_amplitude_g", 1.0),
+    ("vibration_dominant_frequency_hz", 100.0),
+    ("vibration_anomaly_signature_amp_g", 1.0),
+    ("vibration_anomaly_signature_freq_hz", 100.0),
+    ("acoustic_critical_band_db", 30.0),
+)
+
+
+class SemanticDiagnosisCache:
+    """
+    An approximate, in-process cache of LLM diagnoses.
+    A lookup hits when a cached entry was produced from the same set of RAG snippets and a
+    sensor vector within `max_distance` (cosine distance, with a matching magnitude) of the query.
+    Entries are evicted least-recently-used beyond `max_entries` and expire after `ttl_seconds`.
+    """
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 900, max_distance: float = 0.02):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_distance = max_distance
+        self._entries = OrderedDict()  # (vector, rag_signature) -> (unit_vector, norm, response, stored_at)
+        self._lock = threading.RLock()
+        logger.info(f"SemanticDiagnosisCache initialized (max_entries={max_entries}, ttl={ttl_seconds}s, max_distance={max_distance}).")
+
+    @staticmethod
+    def sensor_vector(live_sensor_data: dict) -> tuple:
+        """Builds the scaled feature vector for a trigger; missing or non-numeric readings count as 0."""
+        vector = []
+        for key, scale in SEMANTIC_FEATURES:
+            value = live_sensor_data.get(key)
+            vector.append(round(float(value) / scale, 4) if isinstance(value, (int, float)) else 0.0)
+        return tuple(vector)
+
+    @staticmethod
+    def rag_signature(rag_snippets: list) -> frozenset:
+        """Identifies the RAG context by snippet location ('file.txt:L12'), ignoring the per-query context suffix."""
+        return frozenset(snippet.split(": ", 1)[0] for snippet in rag_snippets)
+
+    def get(self, vector: tuple, rag_signature: frozenset):
+        norm = math.sqrt(sum(v * v for v in vector))
+        if not norm:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, None
+            for key, (unit, cached_norm, _, stored_at) in list(self._entries.items()):
+                if now - stored_at > self.ttl_seconds:
+                    del self._entries[key]
+                    continue
+                if key[1] != rag_signature or abs(cached_norm - norm) > self.max_distance * norm:
+                    continue
+                distance = 1.0 - sum(a * b / norm for a, b in zip(unit, vector))
+                if distance <= self.max_distance and (best_distance is None or distance < best_distance):
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            logger.info(f"Semantic diagnosis cache hit (cosine distance {best_distance:.4f}).")
+            return dict(self._entries[best_key][2])
+
+    def put(self, vector: tuple, rag_signature: frozenset, response: dict):
+        norm = math.sqrt(sum(v * v for v in vector))
+        if not norm:
+            return
+        unit = tuple(v / norm for v in vector)
+        with self._lock:
+            key = (vector, rag_signature)
+            self._entries[key] = (unit, norm, dict(response), time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class TTLCache:
+    """
+    A thread-safe LRU cache whose entries also expire after `ttl_seconds`.
+    Keeps hit/miss/eviction counters so callers can log how effective it is.
+    """
+    def __init__(self, max_size: int = 2000, ttl_seconds: float = 600, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._entries = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.RLock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+        logger.info(f"{self.name} invalidated.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+# Bucket sizes used to decide whether two triggers describe the same asset state.
+FINGERPRINT_BUCKETS = (
+    ("temperature", 0.5),
+    ("temperature_c", 0.5),
+    ("vibration_overall_amplitude_g", 0.1),
+    ("vibration_dominant_frequency_hz", 5.0),
+    ("vibration_anomaly_signature_freq_hz", 5.0),
+)
+
+def sensor_fingerprint(live_sensor_data: dict) -> tuple:
+    """Quantizes the key sensor readings into buckets; missing readings are None."""
+    fingerprint = []
+    for key, step in FINGERPRINT_BUCKETS:
+        value = live_sensor_data.get(key)
+        fingerprint.append(round(value / step) if isinstance(value, (int, float)) else None)
+    return tuple(fingerprint)
+
+
+class AssetTicketIndex:
+    """
+    Remembers, per asset, the sensor fingerprint that last opened a ServiceNow ticket.
+    A later trigger with the same fingerprint within `window_seconds` is treated as a repeat of that incident.
+    """
+    def __init__(self, window_seconds: float = 300):
+        self.window_seconds = window_seconds
+        self._entries = {}  # asset_id -> (fingerprint, stored_at, ticket)
+        self._lock = threading.Lock()
+
+    def remember(self, asset_id: str, fingerprint: tuple, ticket: dict):
+        with self._lock:
+            self._entries[asset_id] = (fingerprint, time.monotonic(), ticket)
+
+    def match(self, asset_id: str, fingerprint: tuple):
+        if all(bucket is None for bucket in fingerprint):
+            return None # No bucketed readings: nothing to show the sensor state is unchanged
+        with self._lock:
+            entry = self._entries.get(asset_id)
+        if entry and entry[0] == fingerprint and time.monotonic() - entry[1] <= self.window_seconds:
+            return entry[2]
+        return None
+
+
+class EventRateLimiter:
+    """
+    A per-key sliding-window limiter: allows at most `max_events` per `window_seconds` for each key.
+    Events over budget are counted in `suppressed` so callers can report how many were dropped.
+    """
+    def __init__(self, max_events: int = 10, window_seconds: float = 60):
+        self.max_events = max_events
+        self.window_seconds = window_seconds
+        self._events = defaultdict(deque)  # key -> timestamps of allowed events
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def allow(self, key) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            events = self._events[key]
+            while events and now - events[0] > self.window_seconds:
+                events.popleft()
+            if len(events) >= self.max_events:
+                self.suppressed += 1
+                return False
+            events.append(now)
+            return True
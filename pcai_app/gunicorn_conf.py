@@ -0,0 +1,26 @@
+# pcai_app/gunicorn_conf.py
+# Gunicorn settings for the PCAI Agent. Values can be overridden through the environment.
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PCAI_LISTEN_PORT', '5000')}"
+
+# Triggers are answered with 202 and analysed on background threads, so a few threaded workers
+# are enough; useful parallelism is bounded by Ollama's OLLAMA_NUM_PARALLEL anyway.
+workers = int(os.environ.get("GUNICORN_WORKERS", min(2 * multiprocessing.cpu_count() + 1, 8)))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+
+# Give in-flight background analyses (LLM call up to request_timeout_seconds) time to finish on restart.
+graceful_timeout = 180
+timeout = 60
+# Edge devices post triggers every few seconds during an anomaly; keep their connections open between posts.
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 30))
+
+# Each worker loads config and builds its own connectors after the fork; preloading would
+# share pooled HTTP connections between workers.
+preload_app = False
+
+accesslog = "-"
+errorlog = "-"
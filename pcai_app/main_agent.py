@@ -1,37 +1,171 @@
 # pcai_app/main_agent.py
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
 import os
+import json
+import re
 import logging 
 import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+import orjson
 
-from utilities import get_utc_timestamp, get_full_config 
+from utilities import get_utc_timestamp, get_full_config, truncate_for_log
 
 from utilities.api_connector import OpsRampConnector, ServiceNowConnector, OllamaConnector
-from .rag_components import RAGSystem
+from .rag_components import RAGSystem, NO_MATCHES_SNIPPET
+from .caching import SemanticDiagnosisCache, TTLCache, AssetTicketIndex, EventRateLimiter, sensor_fingerprint
 
 CONFIG = {} 
 APP_NAME = "PCAIAgentApplication_LLM_RealSN_Final"
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, for request.get_json() and jsonify()."""
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__)
-if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true": 
-    app.logger.setLevel(logging.DEBUG)
-    if not any(isinstance(h, logging.StreamHandler) for h in app.logger.handlers):
+app.json = OrjsonProvider(app)
+if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    # INFO by default; set PCAI_LOG_LEVEL=DEBUG to also log raw LLM output and OpsRamp payloads.
+    app.logger.setLevel(os.environ.get("PCAI_LOG_LEVEL", "INFO").upper())
+    # Reuse Flask's default StreamHandler if present; the formatter is built once here, not per record.
+    handler = next((h for h in app.logger.handlers if isinstance(h, logging.StreamHandler)), None)
+    if handler is None:
         handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter(
-            '%(asctime)s - %(name)s - %(levelname)s - %(module)s:%(lineno)d - %(message)s'
-        ))
         app.logger.addHandler(handler)
+    # An explicit datefmt avoids the extra millisecond formatting pass in formatTime().
+    handler.setFormatter(logging.Formatter(
+        '{asctime} - {name} - {levelname} - {module}:{lineno} - {message}',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        style='{'
+    ))
     app.logger.propagate = False
 
 opsramp_connector: OpsRampConnector = None
 servicenow_connector: ServiceNowConnector = None
 rag_system: RAGSystem = None
 llm_connector: OllamaConnector = None 
+diagnosis_cache: SemanticDiagnosisCache = None
+prompt_cache: TTLCache = None
+recent_tickets: AssetTicketIndex = None
+critical_error_limiter: EventRateLimiter = None
 pcai_agent_id_prefix: str = "PCAI_Agent_Default"
+# Config sections read on every trigger; refreshed by load_configuration().
+_SN_ASSIGNMENT_GROUP: str = "DefaultGroup"
+_CONF_THRESH: float = 0.70
+_EARLY_SN_TICKET: bool = True
+_EARLY_OPSRAMP_LOG: bool = True
+_AI_GATE_THRESHOLDS: dict = {}
+_FAST_PATH_RULES: tuple = ()
+# Set by initialize_services(); read on every trigger instead of re-checking each connector.
+_SERVICES_READY: bool = False
+_LLM_MODEL_NAME: str = "LLM"
 MAX_RAG_SNIPPETS_FOR_LLM_PROMPT = 3
+MAX_ERROR_DETAIL_CHARS = 2048
+# Fixed RAG search terms, unique and sorted so every trigger searches (and ranks snippets) in the same order.
+_BASE_RAG_TERMS = tuple(sorted({"failure", "maintenance", "vibration", "temperature", "acoustic", "GRX-II"}))
+# Runs ticket I/O (early ServiceNow tickets, repeat-trigger work notes) alongside the analyses;
+# created by initialize_services() with 2x pcai_app.max_concurrent_analyses workers.
+_io_executor: ThreadPoolExecutor = None
+# Runs the Ollama connection check alongside each trigger's RAG query. Separate from _io_executor so
+# checks stuck on a slow Ollama cannot hold up ticket I/O.
+_llm_connect_executor: ThreadPoolExecutor = None
+# Runs the background analyses; created by initialize_services() with pcai_app.max_concurrent_analyses workers.
+_analysis_executor: ThreadPoolExecutor = None
+# One slot per running or queued analysis; when none is free, triggers are refused with 503 + Retry-After.
+_analysis_slots: threading.BoundedSemaphore = None
+
+# Sensor summary fragments for the LLM prompt; missing readings render as "N/A".
+_SENSOR_SUMMARY_TEMPLATE = (
+    "Asset ID: {asset_id}\n"
+    "Timestamp of data: {timestamp}\n"
+    "Temperature: {temperature_c}°C (Increase from baseline: {temperature_increase_c}°C)\n"
+    "Overall Vibration: {vibration_overall_amplitude_g}g @ {vibration_dominant_frequency_hz}Hz\n"
+)
+_VIBRATION_ANOMALY_TEMPLATE = "Specific Vibration Anomaly: {vibration_anomaly_signature_amp_g}g at {vibration_anomaly_signature_freq_hz}Hz\n"
+_ACOUSTIC_TEMPLATE = "Acoustic Critical Band: {acoustic_critical_band_db}dB"
+# Static instructions, sent as the Ollama system prompt. Being identical on every call, Ollama can keep
+# this prefix evaluated in the loaded model's context and only process the per-trigger prompt below.
+_SYSTEM_PROMPT = """You are an expert AI Predictive Maintenance diagnostician for industrial wind turbines, model GRX-II.
+Your task is to analyze the provided live sensor data and contextual information from the knowledge base to diagnose potential faults.
+Your response MUST be a single, valid JSON object. Do not include any text outside of this JSON object.
+The JSON object must have the following exact keys and data types:
+- "diagnosis_summary": (string) A concise summary of the most probable fault. If no specific fault is clear, state that further investigation is needed.
+- "confidence_percentage": (float) Your confidence in this diagnosis, as a percentage (e.g., 85.5 for 85.5%). If uncertain, provide a lower confidence (e.g., 30.0). This should be a numerical value.
+- "reasoning": (string) A brief explanation of how you arrived at the diagnosis, referencing specific sensor data points and knowledge base snippets if applicable.
+- "recommended_actions": (list of strings) A list of 1 to 3 actionable steps for maintenance personnel.
+- "required_parts": (list of strings) A list of part numbers or names potentially required for the repair. Use an empty list [] if no specific parts can be determined, or ["N/A"] if not applicable.
+Ensure the output is only the JSON object, starting with { and ending with }.
+"""
+# Filled with %-substitution (no format-spec parsing); the template has no other '%' characters.
+# Ordered from most to least stable: fixed instruction, KB context (recurs across triggers), then the
+# sensor readings (differ every time), so Ollama can reuse the cached prefix as far as possible.
+_PROMPT_TEMPLATE = """Using the knowledge base context and the live sensor data below, please provide a diagnosis as the JSON object described in your instructions.
+%(kb_context)s
+Current Live Sensor Data:
+%(sensor_data)s
+"""
+_KB_CONTEXT_HEADER = "Relevant information from knowledge base (if any):\n"
+_KB_CONTEXT_NONE = _KB_CONTEXT_HEADER + "No specific highly relevant articles were found by the RAG system for the immediate sensor readings and query.\n"
+# Trigger fields that never decide the diagnosis; left out of the exact diagnosis cache key.
+_EXACT_CACHE_IGNORED_KEYS = frozenset({"timestamp"})
+
+# Keywords in the diagnosis summary that escalate a less confident diagnosis to HIGH priority.
+# Substring matches on purpose (e.g. "failures", "criticality"), as with the previous `in` checks.
+_HIGH_PRIORITY_RE = re.compile(r"critical|severe|urgent|immediate|failure", re.IGNORECASE)
+
+@dataclass(slots=True)
+class DiagnosisResult:
+    """The diagnosis fields acted upon by the agent; the defaults describe an unusable LLM response."""
+    summary: str = "LLM processing issue."
+    confidence: float = 0.0
+    reasoning: str = "N/A"
+    actions: list = field(default_factory=lambda: ["Manual inspection required."])
+    parts: list = field(default_factory=lambda: ["N/A"])
+    priority: str = "LOW"
+
+    @classmethod
+    def from_llm_dict(cls, llm_response_data) -> "DiagnosisResult":
+        if not isinstance(llm_response_data, dict) or "error" in llm_response_data:
+            return cls()
+        confidence_val = llm_response_data.get("confidence_percentage", 0.0)
+        result = cls(
+            summary=llm_response_data.get("diagnosis_summary", "LLM processing issue."),
+            confidence=float(confidence_val) / 100.0 if isinstance(confidence_val, (int, float)) else 0.0,
+            reasoning=llm_response_data.get("reasoning", "No reasoning from LLM."),
+            actions=llm_response_data.get("recommended_actions", []),
+            parts=llm_response_data.get("required_parts", []),
+        )
+        # Adjusted priority thresholds for more impactful demo.
+        # The cheap threshold test runs first so the keyword scan is skipped for confident diagnoses.
+        if result.confidence >= 0.8: result.priority = "HIGH"
+        elif _HIGH_PRIORITY_RE.search(result.summary): result.priority = "HIGH"
+        elif result.confidence >= 0.6: result.priority = "MEDIUM"
+        return result
+
+# Built once and returned as-is on every rejection; nothing mutates it per request.
+_NOT_READY_RESPONSE = app.response_class(
+    json.dumps({"status": "error", "message": "PCAI services not ready. AI analysis cannot be started."}),
+    status=503,
+    mimetype='application/json'
+)
+_BUSY_RESPONSE = app.response_class(
+    json.dumps({"status": "error", "message": "PCAI Agent is at capacity. Retry the trigger later."}),
+    status=503,
+    mimetype='application/json',
+    headers={"Retry-After": "30"}
+)
 
 def load_configuration():
-    global CONFIG, pcai_agent_id_prefix
+    global CONFIG, pcai_agent_id_prefix, _SN_ASSIGNMENT_GROUP, _CONF_THRESH, _EARLY_SN_TICKET, _EARLY_OPSRAMP_LOG, _AI_GATE_THRESHOLDS, _FAST_PATH_RULES
     app.logger.info("Attempting to load configuration using common_utils...")
     CONFIG = get_full_config() 
     if not CONFIG:
@@ -41,11 +175,18 @@ def load_configuration():
     company_name = CONFIG.get('company_name_short', 'DefaultCo')
     template = pcai_app_cfg.get('agent_id_prefix_template', "PCAI_Agent_{company_name_short}")
     pcai_agent_id_prefix = template.format(company_name_short=company_name)
+    _SN_ASSIGNMENT_GROUP = pcai_app_cfg.get('servicenow', {}).get('default_assignment_group', "DefaultGroup")
+    _CONF_THRESH = float(pcai_app_cfg.get('diagnosis', {}).get('confidence_threshold_for_action', 0.70))
+    _EARLY_SN_TICKET = pcai_app_cfg.get('diagnosis', {}).get('early_servicenow_ticket', True)
+    _EARLY_OPSRAMP_LOG = pcai_app_cfg.get('diagnosis', {}).get('early_opsramp_log', True)
+    _AI_GATE_THRESHOLDS = pcai_app_cfg.get('diagnosis', {}).get('ai_gate_thresholds') or {}
+    fast_path_cfg = pcai_app_cfg.get('diagnosis', {}).get('fast_path', {})
+    _FAST_PATH_RULES = tuple(rule for rule in fast_path_cfg.get('rules') or () if rule.get('match') and rule.get('diagnosis')) if fast_path_cfg.get('enabled', False) else ()
     app.logger.info(f"Successfully loaded configuration for PCAI Agent ({pcai_agent_id_prefix}).")
     return True
 
 def initialize_services():
-    global opsramp_connector, servicenow_connector, rag_system, llm_connector
+    global opsramp_connector, servicenow_connector, rag_system, llm_connector, diagnosis_cache, prompt_cache, recent_tickets, critical_error_limiter, _SERVICES_READY, _LLM_MODEL_NAME, _analysis_executor, _analysis_slots, _io_executor, _llm_connect_executor
     app.logger.info("Attempting to initialize PCAI services...")
     if not CONFIG: 
         app.logger.error("Cannot initialize services: Global CONFIG is not loaded.")
@@ -59,51 +200,120 @@ def initialize_services():
     try:
         opsramp_connector = OpsRampConnector(opsramp_config=opsramp_cfg, pcai_agent_id=pcai_agent_id_prefix)
         servicenow_connector = ServiceNowConnector(servicenow_config=servicenow_cfg) 
-        rag_system = RAGSystem(knowledge_base_path=kb_path)
+        error_limit_cfg = opsramp_cfg.get('critical_error_rate_limit', {})
+        critical_error_limiter = EventRateLimiter(
+            max_events=error_limit_cfg.get('max_events', 10),
+            window_seconds=error_limit_cfg.get('window_seconds', 60)
+        )
+        rag_cache_cfg = pcai_config.get('rag_query_cache', {})
+        rag_query_cache = TTLCache(
+            max_size=rag_cache_cfg.get('max_size', 2000),
+            ttl_seconds=rag_cache_cfg.get('ttl_seconds', 600),
+            name="RAG query cache"
+        ) if rag_cache_cfg.get('enabled', True) else None
+        rag_system = RAGSystem(knowledge_base_path=kb_path, query_cache=rag_query_cache)
         if not ollama_cfg:
             app.logger.warning("LLM (Ollama) configuration not found or provider not 'ollama'. LLM functionality will be disabled.")
             llm_connector = None
+            _LLM_MODEL_NAME = "LLM"
         else:
             llm_connector = OllamaConnector(ollama_config=ollama_cfg)
-            app.logger.info("OllamaConnector initialized. Connection will be attempted on first API call.")
+            _LLM_MODEL_NAME = llm_connector.model_name
+            app.logger.info(f"OllamaConnector initialized with model '{_LLM_MODEL_NAME}' (quantization: {llm_connector.quantization or 'model default'}). Connection will be attempted on first API call.")
+        semantic_cache_cfg = pcai_config.get('diagnosis', {}).get('semantic_cache', {})
+        if semantic_cache_cfg.get('enabled', True):
+            diagnosis_cache = SemanticDiagnosisCache(
+                max_entries=semantic_cache_cfg.get('max_entries', 512),
+                ttl_seconds=semantic_cache_cfg.get('ttl_seconds', 900),
+                max_distance=semantic_cache_cfg.get('max_distance', 0.02)
+            )
+        exact_cache_cfg = pcai_config.get('diagnosis', {}).get('exact_cache', {})
+        prompt_cache = TTLCache(
+            max_size=exact_cache_cfg.get('max_size', 1024),
+            ttl_seconds=exact_cache_cfg.get('ttl_seconds', 3600),
+            name="LLM prompt cache"
+        ) if exact_cache_cfg.get('enabled', True) else None
+        dedupe_window = pcai_config.get('diagnosis', {}).get('dedupe_window_seconds', 300)
+        recent_tickets = AssetTicketIndex(window_seconds=dedupe_window) if dedupe_window else None
+        if _analysis_executor is None:
+            # Reused threads instead of one new thread per trigger; bursts queue here instead of piling onto Ollama.
+            max_concurrent = int(pcai_config.get('max_concurrent_analyses', 8))
+            _analysis_executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="pcai-analysis")
+            _analysis_slots = threading.BoundedSemaphore(max_concurrent + int(pcai_config.get('max_queued_analyses', 50)))
+            _io_executor = ThreadPoolExecutor(max_workers=2 * max_concurrent, thread_name_prefix="pcai-io")
+            _llm_connect_executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="pcai-llm-connect")
+        # The LLM is optional (TEST MODE diagnosis without it) and connects lazily, so it is not part of readiness.
+        _SERVICES_READY = all([opsramp_connector, servicenow_connector, rag_system])
         app.logger.info("PCAI Services initialization attempt complete.")
+        if pcai_config.get('warm_up_on_start', True):
+            threading.Thread(target=warm_up_services, name="pcai-warmup", daemon=True).start()
         return True
     except Exception as e:
         app.logger.critical(f"CRITICAL: Error initializing core connectors: {e}", exc_info=True)
+        _SERVICES_READY = False
         return False
 
+def warm_up_services():
+    """Loads the LLM (with the system prompt) so the first trigger does not pay the model's cold start."""
+    started = time.monotonic()
+    llm_ready = llm_connector.warm_up(system=_SYSTEM_PROMPT) if llm_connector else False
+    app.logger.info(f"Warm-up complete in {time.monotonic() - started:.1f}s (LLM loaded: {llm_ready}).")
+
 def construct_llm_prompt(asset_id: str, live_sensor_data: dict, rag_snippets: list) -> str:
-    sensor_data_summary = "\n".join([f"Asset ID: {asset_id}"] + [f"Timestamp of data: {live_sensor_data['timestamp']}"] + [
-        f"Temperature: {live_sensor_data.get('temperature_c', 'N/A')}°C (Increase from baseline: {live_sensor_data.get('temperature_increase_c', 'N/A')}°C)"
-    ] + [
-        f"Overall Vibration: {live_sensor_data.get('vibration_overall_amplitude_g', 'N/A')}g @ {live_sensor_data.get('vibration_dominant_frequency_hz', 'N/A')}Hz"
-    ] + [
-        f"Specific Vibration Anomaly: {live_sensor_data.get('vibration_anomaly_signature_amp_g', 'N/A')}g at {live_sensor_data.get('vibration_anomaly_signature_freq_hz', 'N/A')}Hz" if live_sensor_data.get("vibration_anomaly_signature_freq_hz") else ""
-    ] + [
-        f"Acoustic Critical Band: {live_sensor_data.get('acoustic_critical_band_db', 'N/A')}dB"
-    ])
-    knowledge_base_context = "Relevant information from knowledge base (if any):\n"
-    if rag_snippets and rag_snippets[0] != "No specific KB articles found matching the immediate query criteria.":
-        for i, snippet in enumerate(rag_snippets):
-            knowledge_base_context += f"KB{i+1}: {snippet}\n"
+    # Readings arrive with 4 decimals; 2 are plenty for the diagnosis and save prompt tokens.
+    sensor_view = defaultdict(lambda: "N/A", {k: round(v, 2) if isinstance(v, float) else v for k, v in live_sensor_data.items()})
+    sensor_view["asset_id"] = asset_id
+    sensor_data_summary = _SENSOR_SUMMARY_TEMPLATE.format_map(sensor_view)
+    if live_sensor_data.get("vibration_anomaly_signature_freq_hz"):
+        sensor_data_summary += _VIBRATION_ANOMALY_TEMPLATE.format_map(sensor_view)
+    sensor_data_summary += _ACOUSTIC_TEMPLATE.format_map(sensor_view)
+    if rag_snippets and rag_snippets[0] != NO_MATCHES_SNIPPET:
+        kb_context = _KB_CONTEXT_HEADER + "".join(f"KB{i+1}: {snippet}\n" for i, snippet in enumerate(rag_snippets))
     else:
-        knowledge_base_context += "No specific highly relevant articles were found by the RAG system for the immediate sensor readings and query.\n"
-    prompt_template = """You are an expert AI Predictive Maintenance diagnostician for industrial wind turbines, model GRX-II.
-Your task is to analyze the provided live sensor data and contextual information from the knowledge base to diagnose potential faults.
-Current Live Sensor Data:
-{sensor_data}
-{kb_context}
-Based on all the above information, please provide a diagnosis.
-Your response MUST be a single, valid JSON object. Do not include any text outside of this JSON object.
-The JSON object must have the following exact keys and data types:
-- "diagnosis_summary": (string) A concise summary of the most probable fault. If no specific fault is clear, state that further investigation is needed.
-- "confidence_percentage": (float) Your confidence in this diagnosis, as a percentage (e.g., 85.5 for 85.5%). If uncertain, provide a lower confidence (e.g., 30.0). This should be a numerical value.
-- "reasoning": (string) A brief explanation of how you arrived at the diagnosis, referencing specific sensor data points and knowledge base snippets if applicable.
-- "recommended_actions": (list of strings) A list of 1 to 3 actionable steps for maintenance personnel.
-- "required_parts": (list of strings) A list of part numbers or names potentially required for the repair. Use an empty list [] if no specific parts can be determined, or ["N/A"] if not applicable.
-Ensure the output is only the JSON object, starting with {{ and ending with }}.
-"""
-    return prompt_template.format(sensor_data=sensor_data_summary, kb_context=knowledge_base_context)
+        kb_context = _KB_CONTEXT_NONE
+    return _PROMPT_TEMPLATE % {"sensor_data": sensor_data_summary, "kb_context": kb_context}
+
+def exact_cache_key(asset_id: str, live_sensor_data: dict, rag_snippets: list) -> tuple:
+    """
+    Key of the exact diagnosis cache: the asset, its readings rounded as in the prompt, and the RAG snippet locations.
+    The per-message timestamp is left out, since it changes every trigger without changing the diagnosis.
+    """
+    readings = tuple(sorted(
+        (key, round(value, 2) if isinstance(value, float) else value if isinstance(value, (str, int, type(None))) else repr(value))
+        for key, value in live_sensor_data.items() if key not in _EXACT_CACHE_IGNORED_KEYS
+    ))
+    return (asset_id, readings, SemanticDiagnosisCache.rag_signature(rag_snippets))
+
+def meets_servicenow_threshold(diagnosis: DiagnosisResult) -> bool:
+    return diagnosis.priority == "HIGH" and diagnosis.confidence >= _CONF_THRESH and bool(servicenow_connector.api_user)
+
+def build_servicenow_description(diagnosis: DiagnosisResult, rag_snippets_for_llm: list) -> str:
+    sn_parts = [
+        f"AI Diagnosis ({_LLM_MODEL_NAME}):\n{diagnosis.summary}\n\n",
+        f"Confidence: {diagnosis.confidence*100:.1f}%\n",
+        f"AI Reasoning: {diagnosis.reasoning}\n\n",
+        "Recommended Actions:\n- ", "\n- ".join(diagnosis.actions), "\n\n",
+        "Potentially Required Parts: ", ", ".join(diagnosis.parts if diagnosis.parts else ['N/A']), "\n\n",
+        "Key RAG Snippets Considered by AI:\n",
+    ]
+    if rag_snippets_for_llm and rag_snippets_for_llm[0] != NO_MATCHES_SNIPPET:
+        sn_parts.extend(f"- {s[:150]}...\n" for s in rag_snippets_for_llm)
+    else:
+        sn_parts.append("- No specific KB articles retrieved.\n")
+    return "".join(sn_parts)
+
+def create_servicenow_ticket(asset_id: str, diagnosis: DiagnosisResult, rag_snippets_for_llm: list) -> dict:
+    return servicenow_connector.create_work_order(
+        asset_id=asset_id,
+        short_description=f"AI DETECTED ({diagnosis.priority}): {diagnosis.summary[:80]} - {asset_id}",
+        description=build_servicenow_description(diagnosis, rag_snippets_for_llm), 
+        priority=diagnosis.priority,
+        assignment_group=_SN_ASSIGNMENT_GROUP,
+        recommended_parts=diagnosis.parts, 
+        ai_confidence=diagnosis.confidence, 
+        ai_reasoning=diagnosis.reasoning,
+        ai_recommended_actions=diagnosis.actions
+    )
 
 def process_analysis_in_background(trigger_data):
     with app.app_context():
@@ -112,16 +322,62 @@ def process_analysis_in_background(trigger_data):
         app.logger.info(f"[BG Thread] Starting analysis for asset: {asset_id}")
         ai_thought_process = {"1_edge_trigger_summary": trigger_data.get("edge_detected_anomalies")}
         try:
-            search_terms = ["failure", "maintenance", "vibration", "temperature", "acoustic", "GRX-II", asset_id]
-            if live_sensor_data.get("vibration_anomaly_signature_freq_hz"):
-                search_terms.append(f"{int(live_sensor_data['vibration_anomaly_signature_freq_hz'])}hz")
-            rag_snippets_full = rag_system.query_knowledge_base(asset_id, live_sensor_data, list(set(search_terms)))
-            rag_snippets_for_llm = rag_snippets_full[:MAX_RAG_SNIPPETS_FOR_LLM_PROMPT]
-            ai_thought_process["2_rag_query_results"] = {"search_terms": list(set(search_terms)), "retrieved_snippets_count": len(rag_snippets_full), "top_snippets_for_llm": rag_snippets_for_llm}
+            # A well-known signature is diagnosed from its configured rule, without RAG or the LLM.
+            fast_rule = match_fast_path_rule(live_sensor_data)
+            # The Ollama liveness check is a network round trip (with retries); run it while the RAG query works.
+            ollama_client_future = llm_connector.connect_async(_llm_connect_executor) if llm_connector and not fast_rule else None
+            if fast_rule:
+                rag_snippets_for_llm = []
+                ai_thought_process["2_rag_query_results"] = {"skipped": f"Fast-path rule matched: {fast_rule.get('name', 'unnamed')}"}
+            else:
+                search_terms = _BASE_RAG_TERMS + (asset_id,)
+                anomaly_freq_hz = live_sensor_data.get("vibration_anomaly_signature_freq_hz")
+                if anomaly_freq_hz:
+                    search_terms += (f"{int(anomaly_freq_hz)}hz",)
+                rag_snippets_full = rag_system.query_knowledge_base(asset_id, live_sensor_data, search_terms)
+                rag_snippets_for_llm = rag_snippets_full[:MAX_RAG_SNIPPETS_FOR_LLM_PROMPT]
+                ai_thought_process["2_rag_query_results"] = {"search_terms": list(search_terms), "retrieved_snippets_count": len(rag_snippets_full), "top_snippets_for_llm": rag_snippets_for_llm}
             
-            if llm_connector:
+            early_ticket = {}
+            preliminary = {}
+            def on_partial_diagnosis(members):
+                # Summary and confidence alone decide priority, so follow-up actions can start while the rest streams in.
+                if preliminary or not {"diagnosis_summary", "confidence_percentage"} <= members.keys():
+                    return
+                partial = preliminary["diagnosis"] = DiagnosisResult.from_llm_dict({"reasoning": "Pending: the AI diagnosis is still being generated.", **members})
+                if _EARLY_OPSRAMP_LOG:
+                    opsramp_connector.send_pcai_log(asset_id, "INFO", f"Preliminary AI diagnosis ({partial.priority}, confidence {partial.confidence*100:.1f}%): {partial.summary}",
+                                                    details={"status": "Reasoning, actions and parts are still being generated."})
+                if _EARLY_SN_TICKET and meets_servicenow_threshold(partial):
+                    app.logger.info("ServiceNow conditions met from the streamed diagnosis. Creating the work order early.")
+                    early_ticket["future"] = _io_executor.submit(create_servicenow_ticket, asset_id, partial, rag_snippets_for_llm)
+
+            if fast_rule:
+                llm_response_data = dict(fast_rule["diagnosis"])
+                ai_thought_process["3_fast_path_rule"] = fast_rule.get("name", "unnamed")
+            elif llm_connector:
                 llm_prompt = construct_llm_prompt(asset_id, live_sensor_data, rag_snippets_for_llm)
-                llm_response_data = llm_connector.generate_structured_diagnosis(llm_prompt)
+                # Exact tier first (same asset, rounded readings and snippets), then the approximate sensor-vector tier.
+                prompt_key = exact_cache_key(asset_id, live_sensor_data, rag_snippets_for_llm)
+                cached = prompt_cache.get(prompt_key) if prompt_cache else None
+                llm_response_data = dict(cached) if cached else None
+                cache_tier = "exact" if llm_response_data else None
+                if llm_response_data is None and diagnosis_cache:
+                    sensor_vector = diagnosis_cache.sensor_vector(live_sensor_data)
+                    rag_signature = diagnosis_cache.rag_signature(rag_snippets_for_llm)
+                    llm_response_data = diagnosis_cache.get(sensor_vector, rag_signature)
+                    cache_tier = "semantic" if llm_response_data else None
+                ai_thought_process["3_llm_diagnosis_cache_hit"] = cache_tier
+                if llm_response_data is None:
+                    llm_response_data = llm_connector.generate_structured_diagnosis(
+                        llm_prompt, system=_SYSTEM_PROMPT, client_future=ollama_client_future,
+                        on_partial=on_partial_diagnosis if (_EARLY_SN_TICKET or _EARLY_OPSRAMP_LOG) else None
+                    )
+                    if isinstance(llm_response_data, dict) and "error" not in llm_response_data:
+                        if prompt_cache:
+                            prompt_cache.put(prompt_key, dict(llm_response_data))
+                        if diagnosis_cache:
+                            diagnosis_cache.put(sensor_vector, rag_signature, llm_response_data)
             else:
                 llm_response_data = {
                   "diagnosis_summary": "TEST MODE: High-frequency vibration indicates bearing issue.",
@@ -132,72 +388,133 @@ def process_analysis_in_background(trigger_data):
                 }
             ai_thought_process["3_llm_diagnosis_response"] = llm_response_data
 
-            final_diagnosis_summary, confidence, reasoning, recommended_actions, required_parts, priority_level = "LLM processing issue.", 0.0, "N/A", ["Manual inspection required."], ["N/A"], "LOW"
+            diagnosis = DiagnosisResult.from_llm_dict(llm_response_data)
             if isinstance(llm_response_data, dict) and "error" not in llm_response_data:
-                final_diagnosis_summary = llm_response_data.get("diagnosis_summary", final_diagnosis_summary)
-                confidence_val = llm_response_data.get("confidence_percentage", 0.0)
-                confidence = float(confidence_val) / 100.0 if isinstance(confidence_val, (int, float)) else 0.0
-                reasoning = llm_response_data.get("reasoning", "No reasoning from LLM.")
-                recommended_actions = llm_response_data.get("recommended_actions", [])
-                required_parts = llm_response_data.get("required_parts", [])
-                # --- MODIFICATION START ---
-                # Adjusted priority thresholds for more impactful demo
-                if confidence >= 0.8 or any(kw in final_diagnosis_summary.lower() for kw in ["critical", "severe", "urgent", "immediate", "failure"]): priority_level = "HIGH"
-                elif confidence >= 0.6: priority_level = "MEDIUM"
-                # --- MODIFICATION END ---
-                app.logger.info(f"LLM Diagnosis: Summary='{final_diagnosis_summary}', Confidence={confidence*100:.1f}%, Priority={priority_level}")
-            
-            sn_config = CONFIG.get('pcai_app', {}).get('servicenow', {})
-            confidence_threshold_sn = CONFIG.get('pcai_app', {}).get('diagnosis', {}).get('confidence_threshold_for_action', 0.70)
+                app.logger.info(f"LLM Diagnosis: Summary='{diagnosis.summary}', Confidence={diagnosis.confidence*100:.1f}%, Priority={diagnosis.priority}")
+            else:
+                app.logger.warning(f"LLM diagnosis unusable, falling back to defaults: {truncate_for_log(llm_response_data, 1000)}")
             
-            if priority_level == "HIGH" and confidence >= confidence_threshold_sn and servicenow_connector.api_user:
+            if meets_servicenow_threshold(diagnosis):
                 app.logger.info("ServiceNow conditions met. Initiating ServiceNow Work Order.")
-                actions_str = "- " + "\n- ".join(recommended_actions)
-                parts_str = ", ".join(required_parts if required_parts else ['N/A'])
-                rag_context_for_sn = "".join([f"- {s[:150]}...\n" for s in rag_snippets_for_llm]) if rag_snippets_for_llm and rag_snippets_for_llm[0] != "No specific KB articles found matching the immediate query criteria." else "- No specific KB articles retrieved.\n"
-                sn_description = f"""AI Diagnosis ({llm_connector.model_name if llm_connector else 'LLM'}):\n{final_diagnosis_summary}\n\nConfidence: {confidence*100:.1f}%\nAI Reasoning: {reasoning}\n\nRecommended Actions:\n{actions_str}\n\nPotentially Required Parts: {parts_str}\n\nKey RAG Snippets Considered by AI:\n{rag_context_for_sn}"""
-                
-                sn_response = servicenow_connector.create_work_order(
-                    asset_id=asset_id,
-                    short_description=f"AI DETECTED ({priority_level}): {final_diagnosis_summary[:80]} - {asset_id}",
-                    description=sn_description, 
-                    priority=priority_level,
-                    assignment_group=sn_config.get('default_assignment_group', "DefaultGroup"),
-                    recommended_parts=required_parts, 
-                    ai_confidence=confidence, 
-                    ai_reasoning=reasoning,
-                    ai_recommended_actions=recommended_actions
-                )
+                if early_ticket:
+                    # Created from the streamed summary/confidence (which fully determine priority); fill in the rest.
+                    sn_response = early_ticket["future"].result()
+                    if sn_response.get("status") == "success":
+                        sn_response["update"] = servicenow_connector.update_work_order(
+                            sn_response["sys_id"],
+                            description=build_servicenow_description(diagnosis, rag_snippets_for_llm),
+                            recommended_parts=diagnosis.parts,
+                            ai_confidence=diagnosis.confidence,
+                            ai_reasoning=diagnosis.reasoning,
+                            ai_recommended_actions=diagnosis.actions
+                        )
+                    sn_response["created_while_streaming"] = True
+                else:
+                    sn_response = create_servicenow_ticket(asset_id, diagnosis, rag_snippets_for_llm)
                 ai_thought_process["4_automated_action_summary"] = {"action_taken": "Created ServiceNow Incident", "servicenow_response": sn_response}
+                if recent_tickets and sn_response.get("status") == "success":
+                    recent_tickets.remember(asset_id, sensor_fingerprint(live_sensor_data), sn_response)
+            elif early_ticket:
+                app.logger.warning("A ServiceNow ticket was created from the streamed diagnosis, but the complete LLM response was unusable.")
+                ai_thought_process["4_automated_action_summary"] = {"action_taken": "Created ServiceNow Incident from partial diagnosis", "servicenow_response": early_ticket["future"].result()}
             else:
-                 ai_thought_process["4_automated_action_summary"] = {"action_taken": "None", "reason": f"Confidence {confidence*100:.1f}% or priority '{priority_level}' did not meet threshold."}
+                 ai_thought_process["4_automated_action_summary"] = {"action_taken": "None", "reason": f"Confidence {diagnosis.confidence*100:.1f}% or priority '{diagnosis.priority}' did not meet threshold."}
             
             # --- MODIFICATION START ---
             # This logic now maps priority level to a more meaningful OpsRamp log level
             final_log_level = "INFO" # Default
-            if priority_level == "HIGH":
+            if diagnosis.priority == "HIGH":
                 final_log_level = "CRITICAL"
-            elif priority_level == "MEDIUM":
+            elif diagnosis.priority == "MEDIUM":
                 final_log_level = "WARN"
             # --- MODIFICATION END ---
             
-            opsramp_connector.send_pcai_log(asset_id, final_log_level, f"AI Analysis Complete: {final_diagnosis_summary}", details=ai_thought_process)
-            app.logger.info(f"Sent consolidated AI thought process to OpsRamp for asset: {asset_id}")
+            opsramp_connector.send_pcai_log(asset_id, final_log_level, f"AI Analysis Complete: {diagnosis.summary}", details=ai_thought_process)
+            app.logger.info(f"Queued consolidated AI thought process for OpsRamp for asset: {asset_id}")
 
         except Exception as e:
             app.logger.error(f"[BG Thread] Unhandled exception during background analysis for asset {asset_id}: {e}", exc_info=True)
-            ai_thought_process["error"] = f"Unhandled exception: {type(e).__name__} - {str(e)}"
-            if opsramp_connector:
-                opsramp_connector.send_pcai_log(asset_id, "CRITICAL_ERROR", "Internal PCAI Agent error during background analysis", details=ai_thought_process)
+            ai_thought_process["error"] = f"Unhandled exception: {error_detail(e)}"
+            report_critical_error(asset_id, "Internal PCAI Agent error during background analysis", ai_thought_process)
+
+def error_detail(e: Exception) -> str:
+    """repr() of an exception, capped so a huge payload (e.g. a full LLM response) does not bloat the OpsRamp event."""
+    return repr(e)[:MAX_ERROR_DETAIL_CHARS]
+
+def report_critical_error(asset_id: str, message: str, details: dict, wait: bool = True):
+    """
+    Sends a CRITICAL_ERROR event to OpsRamp unless this asset has already used its error budget for the window.
+    With wait=False the event is only queued, so a request thread never blocks on OpsRamp.
+    """
+    if not opsramp_connector:
+        return
+    if critical_error_limiter and not critical_error_limiter.allow(asset_id):
+        app.logger.error(f"OpsRamp CRITICAL_ERROR for asset {asset_id} suppressed by rate limit ({critical_error_limiter.suppressed} suppressed so far): {message}")
+        return
+    if wait:
+        opsramp_connector.send_pcai_log_sync(asset_id, "CRITICAL_ERROR", message, details=details)
+    else:
+        opsramp_connector.send_pcai_log(asset_id, "CRITICAL_ERROR", message, details=details)
+
+def requires_ai_analysis(live_sensor_data: dict) -> bool:
+    """False only when every gated reading in the trigger is below its threshold; missing readings cannot rule out a fault."""
+    readings = [(live_sensor_data.get(key), limit) for key, limit in _AI_GATE_THRESHOLDS.items()]
+    known = [(value, limit) for value, limit in readings if isinstance(value, (int, float))]
+    return not known or any(value >= limit for value, limit in known)
+
+def _reading_in_range(value, bounds) -> bool:
+    low, high = bounds
+    return isinstance(value, (int, float)) and (low is None or value >= low) and (high is None or value <= high)
+
+def match_fast_path_rule(live_sensor_data: dict):
+    """Returns the first fast-path rule whose [min, max] ranges all contain the trigger's readings, or None."""
+    for rule in _FAST_PATH_RULES:
+        if all(_reading_in_range(live_sensor_data.get(key), bounds) for key, bounds in rule["match"].items()):
+            return rule
+    return None
+
+def record_repeat_trigger(asset_id: str, trigger_data: dict, ticket: dict):
+    """Correlates a repeat trigger with the asset's open ticket instead of re-running the analysis."""
+    with app.app_context():
+        anomalies = trigger_data.get("edge_detected_anomalies")
+        note = f"Repeat anomaly trigger received at {get_utc_timestamp()} with unchanged sensor state. Edge anomalies: {json.dumps(anomalies)}"
+        sn_response = servicenow_connector.append_work_note(ticket["sys_id"], note)
+        opsramp_connector.send_pcai_log(asset_id, "INFO", f"Repeat trigger correlated with ServiceNow ticket {ticket.get('work_order_id')}",
+                                        details={"1_edge_trigger_summary": anomalies, "servicenow_work_note": sn_response})
 
 @app.route('/api/v1/analyze_trigger', methods=['POST'])
 def analyze_trigger():
+    if not _SERVICES_READY:
+        app.logger.warning("Rejecting trigger: PCAI services are not initialized.")
+        return _NOT_READY_RESPONSE
     trigger_data = request.get_json()
-    if not trigger_data:
+    if not trigger_data or not isinstance(trigger_data, dict):
         return jsonify({"status": "error", "message": "Invalid JSON payload"}), 400
-    thread = threading.Thread(target=process_analysis_in_background, args=(trigger_data,))
-    thread.daemon = True
-    thread.start()
+    g.asset_id = trigger_data.get("asset_id", "UnknownAssetOnPayload")
+    live_sensor_data = trigger_data.get("full_sensor_data_at_trigger", {})
+    if not isinstance(live_sensor_data, dict):
+        return jsonify({"status": "error", "message": "'full_sensor_data_at_trigger' must be a JSON object"}), 400
+    if not requires_ai_analysis(live_sensor_data):
+        opsramp_connector.send_pcai_log(g.asset_id, "INFO", "Sub-threshold trigger; AI analysis skipped",
+                                        details={"1_edge_trigger_summary": trigger_data.get("edge_detected_anomalies"), "ai_gate_thresholds": _AI_GATE_THRESHOLDS})
+        app.logger.info(f"--- Trigger for {g.asset_id} is below all AI gate thresholds; skipping RAG and LLM ---")
+        return jsonify({"status": "skipped", "message": "Sensor readings are below the AI analysis thresholds."}), 200
+    if recent_tickets:
+        asset_id = g.asset_id
+        ticket = recent_tickets.match(asset_id, sensor_fingerprint(live_sensor_data))
+        if ticket:
+            _io_executor.submit(record_repeat_trigger, asset_id, trigger_data, ticket)
+            app.logger.info(f"--- Repeat trigger for {asset_id}; correlated with ServiceNow ticket {ticket.get('work_order_id')} ---")
+            return jsonify({"status": "duplicate", "message": "Sensor state unchanged since the last analysis; correlated with the open ServiceNow ticket.", "work_order_id": ticket.get("work_order_id")}), 200
+    if not _analysis_slots.acquire(blocking=False):
+        app.logger.warning(f"Rejecting trigger for {g.asset_id}: analysis backlog is full.")
+        return _BUSY_RESPONSE
+    try:
+        future = _analysis_executor.submit(process_analysis_in_background, trigger_data)
+    except Exception:
+        _analysis_slots.release() # The done-callback that normally frees the slot was never attached
+        raise
+    future.add_done_callback(lambda _: _analysis_slots.release())
     app.logger.info("--- Sent 202 Accepted: AI analysis started in background ---")
     return jsonify({"status": "accepted", "message": "AI analysis has been started in the background."}), 202
 
@@ -210,9 +527,11 @@ def health_check():
 
 @app.errorhandler(Exception) 
 def handle_flask_error(e):
+    if isinstance(e, HTTPException):
+        # Expected client/routing errors (404, 405, 415, ...) keep their status and are not OpsRamp incidents.
+        return e
     app.logger.error(f"Unhandled Flask application error: {e}", exc_info=True)
-    if opsramp_connector:
-        opsramp_connector.send_pcai_log("UnknownAssetFromFlaskError", "CRITICAL_ERROR", f"Unhandled PCAI Agent Flask error: {type(e).__name__}", {"error_details": str(e)})
+    report_critical_error(getattr(g, "asset_id", "UnknownAssetFromFlaskError"), f"Unhandled PCAI Agent Flask error: {type(e).__name__}", {"error_details": error_detail(e)}, wait=False)
     return jsonify(error=f"Flask App Error: {type(e).__name__} - {str(e)}", message="An internal server error occurred in Flask app."), 500
 
 if __name__ == '__main__':
@@ -222,7 +541,5 @@ if __name__ == '__main__':
     else:
         host = CONFIG.get('pcai_app', {}).get('listen_host', '0.0.0.0')
         port = int(CONFIG.get('pcai_app', {}).get('listen_port', 5000))
-        llm_model_name_for_log = "N/A"
-        if llm_connector: llm_model_name_for_log = llm_connector.model_name
-        app.logger.info(f"Starting {APP_NAME} Flask server on {host}:{port} (LLM: {llm_model_name_for_log})")
+        app.logger.info(f"Starting {APP_NAME} Flask server on {host}:{port} (LLM: {_LLM_MODEL_NAME if llm_connector else 'N/A'})")
         app.run(host=host, port=port, debug=True, use_reloader=False)
\ No newline at end of file
@@ -3,17 +3,46 @@
 import os
 import re
 import logging
+import functools
 
 logger = logging.getLogger(__name__)
 
+# Returned as the only snippet when a query matches nothing.
+NO_MATCHES_SNIPPET = "No specific KB articles found matching the immediate query criteria."
+
+@functools.lru_cache(maxsize=256)
+def _read_kb_file(file_path: str, mtime_ns: int, size: int) -> str:
+    """Reads a KB file; keyed on its stat so RAGSystem instances and reloads share unchanged files' text."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+# Contextual search blocks as (name, file-level pattern, line condition). When the knowledge base is loaded,
+# each block records the first line satisfying its condition in every file whose content matches the pattern.
+_CONTEXT_LINE_RULES = (
+    # Block 1: High-frequency vibrations & gear tooth pitting (115-125Hz)
+    ("gear_pitting", re.compile(r"gear tooth pitting", re.IGNORECASE),
+     lambda line: "115-125Hz" in line and "gear tooth pitting" in line),
+    # Block 2: 120Hz spikes and bearing assembly failure ("120Hz" in a KB line implies ~115-125Hz contextually)
+    ("bearing_failure", re.compile(r"(G-5432|bearing assembly failure)", re.IGNORECASE),
+     lambda line: "120Hz" in line and ("G-5432" in line or "bearing assembly failure" in line)),
+    # Block 3: Oil temperature correlation
+    ("oil_temp", re.compile(r"rise >5°C|accelerated wear", re.IGNORECASE),
+     lambda line: "GRX-II" in line and "oil temperature" in line and "rise >5°C" in line),
+)
+
 class RAGSystem:
     """
     A simplified Retrieval Augmented Generation system.
     It loads text files from a knowledge base and performs basic keyword searches.
     """
-    def __init__(self, knowledge_base_path: str):
+    def __init__(self, knowledge_base_path: str, query_cache=None):
         self.knowledge_base_path = knowledge_base_path
         self.kb_data = {} # To store content of loaded files: {'filename': 'content'}
+        self.kb_lines = {} # {'filename': [lines]}, split once at load time
+        self.kb_lines_lower = {} # {'filename': [lowercased lines]} for the case-insensitive term search
+        self.kb_content_lower = {} # {'filename': lowercased content}, to skip files that lack a term entirely
+        self.kb_context_lines = {} # {'filename': {block name: line index or None}}, see _CONTEXT_LINE_RULES
+        self.query_cache = query_cache # Optional TTLCache of matched lines, see query_knowledge_base()
         self._load_knowledge_base()
         logger.info(f"RAGSystem initialized. Knowledge base path: {self.knowledge_base_path}")
 
@@ -35,18 +64,35 @@ class RAGSystem:
                 return
 
         loaded_files_count = 0
-        for filename in os.listdir(effective_path):
-            if filename.endswith(".txt"):
-                file_path = os.path.join(effective_path, filename)
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        self.kb_data[filename] = f.read()
-                    loaded_files_count +=1
-                    logger.info(f"RAGSystem loaded: {filename}")
-                except Exception as e:
-                    logger.error(f"RAGSystem failed to load {filename}: {e}")
+        with os.scandir(effective_path) as entries:
+            for entry in entries:
+                if entry.name.endswith(".txt") and entry.is_file():
+                    filename, file_path = entry.name, entry.path
+                    try:
+                        stat = entry.stat()
+                        content = _read_kb_file(os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+                        self.kb_data[filename] = content
+                        self.kb_lines[filename] = content.splitlines()
+                        self.kb_lines_lower[filename] = [line.lower() for line in self.kb_lines[filename]]
+                        self.kb_content_lower[filename] = content.lower()
+                        self.kb_context_lines[filename] = {
+                            name: next((i for i, line in enumerate(self.kb_lines[filename]) if condition(line)), None)
+                            if file_pattern.search(content) else None
+                            for name, file_pattern, condition in _CONTEXT_LINE_RULES
+                        }
+                        loaded_files_count +=1
+                        logger.info(f"RAGSystem loaded: {filename}")
+                    except Exception as e:
+                        logger.error(f"RAGSystem failed to load {filename}: {e}")
         if loaded_files_count == 0:
             logger.warning(f"RAGSystem found no .txt files in {effective_path}")
+        if self.query_cache:
+            self.query_cache.invalidate()
+
+    def reload_knowledge_base(self):
+        """Re-scans the knowledge base (re-reading files whose size or mtime changed) and drops any cached query results."""
+        self.kb_data, self.kb_lines, self.kb_lines_lower, self.kb_content_lower, self.kb_context_lines = {}, {}, {}, {}, {}
+        self._load_knowledge_base()
 
 
     def query_knowledge_base(self, asset_id: str, live_sensor_data: dict, search_terms: list) -> list:
@@ -54,59 +100,72 @@ class RAGSystem:
         Searches the loaded knowledge base for lines containing any of the search terms.
         Also considers specific patterns from live_sensor_data as per demo plan.
         """
-        found_snippets = []
         logger.info(f"RAG Query for Asset {asset_id} with terms: {search_terms}")
-        logger.info(f"RAG Live Sensor Data Context: {live_sensor_data}")
+        logger.debug("RAG Live Sensor Data Context: %s", live_sensor_data)
 
-        # Basic keyword search across all content
-        for term in search_terms:
-            term_regex = re.compile(re.escape(term), re.IGNORECASE)
-            for filename, content in self.kb_data.items():
-                for line_num, line in enumerate(content.splitlines()):
-                    if term_regex.search(line):
-                        snippet = f"{filename}:L{line_num+1}: {line.strip()}"
-                        if snippet not in found_snippets:
-                            found_snippets.append(snippet)
-        
-        # Enhanced contextual search based on sensor data patterns (aligns with demo narrative)
         vib_anomaly_freq = live_sensor_data.get("vibration_anomaly_signature_freq_hz")
-        
-        # Contextual Search Block 1: High-frequency vibrations & gear tooth pitting (115-125Hz)
-        if vib_anomaly_freq and 115 <= vib_anomaly_freq <= 125: # Range covers 121.38Hz
-            for filename, content in self.kb_data.items():
-                # Check for "gear tooth pitting" in the whole file first for efficiency
-                if re.search(r"gear tooth pitting", content, re.IGNORECASE):
-                    for line_num, line in enumerate(content.splitlines()):
-                        if "115-125Hz" in line and "gear tooth pitting" in line:
-                            snippet = f"{filename}:L{line_num+1}: {line.strip()} (Context: Matched {vib_anomaly_freq}Hz)"
-                            if snippet not in found_snippets: found_snippets.append(snippet)
-                            break # Found relevant line in this file, move to next file
-
-        # Contextual Search Block 2: 120Hz spikes and bearing assembly failure (widened range for 121.38Hz)
-        # Assuming "120Hz" in KB snippet implies ~115-125Hz contextually
-        if vib_anomaly_freq and 115 <= vib_anomaly_freq <= 125: # Widened range to catch 121.38Hz
-            for filename, content in self.kb_data.items():
-                if re.search(r"(G-5432|bearing assembly failure)", content, re.IGNORECASE):
-                    for line_num, line in enumerate(content.splitlines()):
-                        # Checking for "120Hz" as a literal string in the line itself, along with parts/failure.
-                        if "120Hz" in line and ("G-5432" in line or "bearing assembly failure" in line):
-                            snippet = f"{filename}:L{line_num+1}: {line.strip()} (Context: Matched {vib_anomaly_freq}Hz)"
-                            if snippet not in found_snippets: found_snippets.append(snippet)
-                            break # Found relevant line in this file, move to next file
-
-        # Contextual Search Block 3: Oil temperature correlation (widened range for 121.38Hz and temp increase)
         temp_increase_c = live_sensor_data.get("temperature_increase_c", 0)
-        if vib_anomaly_freq and 115 <= vib_anomaly_freq <= 125 and temp_increase_c > 4.5: # Widened freq range, checks temp increase
-            for filename, content in self.kb_data.items():
-                if re.search(r"rise >5°C|accelerated wear", content, re.IGNORECASE):
-                    for line_num, line in enumerate(content.splitlines()):
-                        if "GRX-II" in line and "oil temperature" in line and "rise >5°C" in line:
-                            snippet = f"{filename}:L{line_num+1}: {line.strip()} (Context: Matched {vib_anomaly_freq}Hz & {temp_increase_c}°C rise)"
-                            if snippet not in found_snippets: found_snippets.append(snippet)
-                            break # Found relevant line in this file, move to next file
-        
-        if not found_snippets:
+        freq_in_range = bool(vib_anomaly_freq and 115 <= vib_anomaly_freq <= 125) # Range covers 121.38Hz
+        temp_rise = freq_in_range and temp_increase_c > 4.5
+
+        # The matched lines only depend on the terms and which contextual blocks apply; the exact
+        # sensor values are rendered into the snippet afterwards, so cached matches stay accurate.
+        cache_key = (frozenset(search_terms), freq_in_range, temp_rise)
+        matches = self.query_cache.get(cache_key) if self.query_cache else None
+        if matches is None:
+            matches = self._find_matches(search_terms, freq_in_range, temp_rise)
+            if self.query_cache:
+                self.query_cache.put(cache_key, matches)
+        elif self.query_cache:
+            logger.info(f"RAG query cache hit ({self.query_cache.stats()})")
+
+        if not matches:
             logger.info("RAGSystem found no direct matches for the query.")
-            return ["No specific KB articles found matching the immediate query criteria."]
+            return [NO_MATCHES_SNIPPET]
+
+        found_snippets = []
+        for snippet, context in matches:
+            if context == "freq":
+                snippet += f" (Context: Matched {vib_anomaly_freq}Hz)"
+            elif context == "freq_temp":
+                snippet += f" (Context: Matched {vib_anomaly_freq}Hz & {temp_increase_c}°C rise)"
+            found_snippets.append(snippet)
+        return found_snippets
+
+    def _find_matches(self, search_terms: list, freq_in_range: bool, temp_rise: bool) -> list:
+        """
+        Returns (snippet, context) pairs in match order, where context names the sensor
+        values to append to the snippet (None for plain keyword matches).
+        """
+        found = []
+        seen = set() # (filename, line_num, context) of the matches in found, which keeps the match order
+
+        def add(filename, line_num, context):
+            # The snippet text is only built for a line/context pair not matched before
+            if (filename, line_num, context) not in seen:
+                seen.add((filename, line_num, context))
+                found.append((f"{filename}:L{line_num+1}: {self.kb_lines[filename][line_num].strip()}", context))
+
+        # Basic keyword search across all content: a case-insensitive substring test per line
+        for term in search_terms:
+            term_lower = term.lower()
+            for filename, lines_lower in self.kb_lines_lower.items():
+                if term_lower not in self.kb_content_lower[filename]:
+                    continue # One scan of the whole file rules out all of its lines
+                for line_num, line_lower in enumerate(lines_lower):
+                    if term_lower in line_lower:
+                        add(filename, line_num, None)
         
-        return found_snippets
\ No newline at end of file
+        # Enhanced contextual search based on sensor data patterns (aligns with demo narrative).
+        # The matching line of each block was located per file at load time, see _CONTEXT_LINE_RULES.
+        contextual_blocks = []
+        if freq_in_range:
+            contextual_blocks += [("gear_pitting", "freq"), ("bearing_failure", "freq")]
+        if temp_rise:
+            contextual_blocks.append(("oil_temp", "freq_temp"))
+        for block, context in contextual_blocks:
+            for filename, context_lines in self.kb_context_lines.items():
+                if context_lines[block] is not None:
+                    add(filename, context_lines[block], context)
+
+        return found
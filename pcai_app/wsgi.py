@@ -0,0 +1,10 @@
+# pcai_app/wsgi.py
+# WSGI entry point for production servers, e.g.:
+#   gunicorn -c pcai_app/gunicorn_conf.py pcai_app.wsgi:app
+# `python -m pcai_app.main_agent` remains the single-process local/dev runner.
+
+from .main_agent import app, load_configuration, initialize_services
+
+if not (load_configuration() and initialize_services()):
+    # Keep serving so /healthz stays up; triggers are rejected with 503 until services are ready.
+    app.logger.critical("FATAL: Configuration or service initialization failed in WSGI worker.")
@@ -8,13 +8,15 @@ different components of the predictive maintenance demo.
 
 Currently includes helpers for:
 - Generating standardized UTC timestamps.
+- Truncating large payloads for log messages.
 - Loading application-specific sections from the main YAML configuration file.
 """
 
-from .common_utils import get_utc_timestamp, load_app_config, get_full_config
+from .common_utils import get_utc_timestamp, load_app_config, get_full_config, truncate_for_log
 
 __all__ = [
     'get_utc_timestamp',
+    'truncate_for_log',
     'load_app_config',
     'get_full_config'
 ]
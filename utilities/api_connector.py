@@ -1,24 +1,55 @@
 # utilities/api_connector.py
 
+import atexit
+import gzip
 import json
 import os
+import queue
+import threading
 import requests
 from requests.auth import HTTPBasicAuth
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+import httpx
 import ollama
+import orjson
 import logging
 import time
 import uuid
 
-from utilities import get_utc_timestamp
+from utilities import get_utc_timestamp, truncate_for_log
 
 logger = logging.getLogger(__name__)
 
+# (connect, read) timeouts for the REST connectors; connects should fail fast, reads may be slow.
+OPSRAMP_TIMEOUT = (5, 20)
+SERVICENOW_TIMEOUT = (10, 60)
+
+def _pooled_adapter(max_retries=0) -> HTTPAdapter:
+    """Keep-alive connection pool shared by all requests of a connector's session."""
+    return HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=max_retries)
+
+# Most queued OpsRamp logs the background worker combines into one request.
+LOG_BATCH_MAX_EVENTS = 50
+
+# Request bodies smaller than this are not worth compressing.
+GZIP_MIN_BYTES = 1024
+
+def _encode_json_body(payload, gzip_enabled: bool = False):
+    """
+    Serializes `payload` once with orjson and, if enabled and large enough, gzip-compresses it.
+    Returns (json_bytes, body_to_send, extra_headers).
+    """
+    raw = orjson.dumps(payload)
+    if gzip_enabled and len(raw) > GZIP_MIN_BYTES:
+        return raw, gzip.compress(raw, compresslevel=6), {"Content-Encoding": "gzip"}
+    return raw, raw, {}
+
 class OpsRampConnector:
     """
     Connects to OpsRamp to send alerts (events/logs) via the actual REST API.
     Handles OAuth2 token acquisition and refresh, with a retry mechanism for token failures.
+    Logs sent with send_pcai_log() are queued and delivered by a background worker thread.
     """
     def __init__(self, opsramp_config: dict, pcai_agent_id: str):
         self.pcai_agent_id = pcai_agent_id
@@ -31,8 +62,26 @@ class OpsRampConnector:
         self.token_path = opsramp_config.get("token_endpoint_path")
         self.alert_path_template = opsramp_config.get("alert_endpoint_path")
         self.turbine_resource_id = opsramp_config.get("turbine_resource_id")
+        # Only enable if the OpsRamp gateway accepts gzip-encoded request bodies.
+        self.gzip_requests = bool(opsramp_config.get("gzip_requests", False))
         
         self.access_token = None
+        self.session = requests.Session()
+        # Retries only failed connections and gateway errors, where the alert was not accepted; the
+        # auth retry in _post_alerts handles expired tokens.
+        retries = Retry(
+            total=2, connect=2, read=0, backoff_factor=0.3,
+            status_forcelist=[502, 503], allowed_methods={"POST"}, raise_on_status=False
+        )
+        self.session.mount('https://', _pooled_adapter(max_retries=retries))
+        self.session.mount('http://', _pooled_adapter(max_retries=retries))
+        self.session.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+        # Bounded so an unreachable OpsRamp cannot grow the backlog without limit.
+        self.queue_size = int(opsramp_config.get("log_queue_size", 1000))
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._worker = None
+        self._worker_pid = None
+        self._worker_lock = threading.Lock()
         
         if not all([self.tenant_id, self.api_key, self.api_secret, self.api_hostname, self.turbine_resource_id]):
             logger.warning("OpsRamp config or credentials missing. OpsRamp integration will be disabled.")
@@ -55,7 +104,7 @@ class OpsRampConnector:
         headers = {"Content-Type": "application/x-www-form-urlencoded", "Accept": "application/json"}
         payload = {"grant_type": "client_credentials", "client_id": self.api_key, "client_secret": self.api_secret}
         try:
-            response = requests.post(self.token_url, headers=headers, data=payload, timeout=20)
+            response = self.session.post(self.token_url, headers=headers, data=payload, timeout=OPSRAMP_TIMEOUT)
             response.raise_for_status()
             self.access_token = response.json().get("access_token")
             if self.access_token:
@@ -66,19 +115,129 @@ class OpsRampConnector:
                 self.access_token = None
                 return False
         except requests.exceptions.RequestException as e:
-            logger.error(f"Error getting OpsRamp access token: {e}", exc_info=True)
+            logger.error(f"Error getting OpsRamp access token: {type(e).__name__}: {e}")
             self.access_token = None
             return False
 
     def send_pcai_log(self, asset_id: str, log_level: str, message: str, details: dict = None):
         """
-        Formats and sends a log/event as an Alert to OpsRamp.
+        Queues a log/event to be sent as an Alert to OpsRamp and returns immediately.
+        Delivery (with the token retry) happens on a background worker; use send_pcai_log_sync() when the outcome matters.
+        """
+        if not self.alert_url:
+            logger.warning("OpsRamp alert URL not configured. Cannot send alert.")
+            return {"status": "error", "message": "Configuration error"}
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait((asset_id, [{"level": log_level, "message": message, "details": details}]))
+        except queue.Full:
+            logger.warning(f"OpsRamp log queue is full (limit {self.queue_size}). Dropping log for asset {asset_id}: {message[:110]}")
+            return {"status": "error", "message": "Log queue full"}
+        return {"status": "queued"}
+
+    def send_pcai_log_sync(self, asset_id: str, log_level: str, message: str, details: dict = None):
+        """
+        Formats and sends a log/event as an Alert to OpsRamp, blocking until OpsRamp answers.
         Includes a retry mechanism and adds a unique ID to the subject to prevent de-duplication.
         """
+        return self.send_pcai_log_batch(asset_id, [{"level": log_level, "message": message, "details": details}])
+
+    def flush(self, timeout: float = 10.0):
+        """Waits up to `timeout` seconds for queued logs to be delivered."""
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(f"Timed out flushing OpsRamp log queue ({self._queue.unfinished_tasks} pending).")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._worker_lock:
+            if self._worker_pid == os.getpid() and self._worker.is_alive():
+                return
+            if self._worker_pid is None:
+                atexit.register(self.flush)
+            elif self._worker_pid != os.getpid():
+                # Created before a fork: the parent's worker thread does not exist in this process.
+                self._queue = queue.Queue(maxsize=self.queue_size)
+            self._worker = threading.Thread(target=self._drain_queue, args=(self._queue,), name="opsramp-log-worker", daemon=True)
+            self._worker.start()
+            self._worker_pid = os.getpid()
+
+    def _drain_queue(self, log_queue: queue.Queue):
+        while True:
+            # Coalesce whatever else is already waiting, so a burst of logs becomes one request per asset.
+            pending = [log_queue.get()]
+            while len(pending) < LOG_BATCH_MAX_EVENTS:
+                try:
+                    pending.append(log_queue.get_nowait())
+                except queue.Empty:
+                    break
+            events_by_asset = {}
+            for asset_id, events in pending:
+                events_by_asset.setdefault(asset_id, []).extend(events)
+            try:
+                for asset_id, events in events_by_asset.items():
+                    self.send_pcai_log_batch(asset_id, events)
+            except Exception as e:
+                logger.error(f"Unexpected error delivering queued OpsRamp log: {e}", exc_info=True)
+            finally:
+                for _ in pending:
+                    log_queue.task_done()
+
+    def send_pcai_log_batch(self, asset_id: str, events: list):
+        """
+        Sends several logs/events for one asset as Alerts in a single OpsRamp request.
+        Each event is a dict with "level", "message" and optional "details", as for send_pcai_log().
+        """
         if not self.alert_url:
             logger.warning("OpsRamp alert URL not configured. Cannot send alert.")
             return {"status": "error", "message": "Configuration error"}
+        if not events:
+            return {"status": "success"}
+
+        # The alerts endpoint accepts a JSON array, so the whole batch is one round trip.
+        payload = [self._build_alert(asset_id, e.get("level", "INFO"), e.get("message", ""), e.get("details")) for e in events]
+        return self._post_alerts(payload)
+
+    def _build_alert(self, asset_id: str, log_level: str, message: str, details: dict = None) -> dict:
+        log_level_upper = log_level.upper()
+        priority_map = {"CRITICAL": "P1", "ERROR": "P2", "WARN": "P3", "INFO": "P5", "SUCCESS": "P5"}
+        state_map = {"CRITICAL": "CRITICAL", "ERROR": "CRITICAL", "WARN": "WARNING", "INFO": "OK", "SUCCESS": "OK"}
+        current_state = state_map.get(log_level_upper, "OK")
+        description_lines = [f"{message}", "", "Details:"]
+        if details:
+            for key, value in details.items():
+                value_str = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
+                description_lines.append(f"- {key}: {value_str}")
+        description = "\n".join(description_lines)
+        
+        # --- START OF FIX ---
+        # Generate a short unique ID to prepend to the subject line.
+        # This is the most reliable way to prevent alert de-duplication.
+        short_unique_id = str(uuid.uuid4()).split('-')[0]
+        subject = f"[{short_unique_id}] AI Agent Log ({current_state}): {message[:110]}"
+        # --- END OF FIX ---
 
+        return {
+            "subject": subject,
+            "currentState": current_state,
+            "priority": priority_map.get(log_level_upper, "P5"),
+            "description": description,
+            "customFields": [], # Custom fields are not needed for this fix
+            "device": {"resourceUUID": self.turbine_resource_id},
+            "app": "Custom",
+            "serviceName": asset_id
+        }
+
+    def _post_alerts(self, payload: list):
+        # Serialized once: the same body is logged (truncated) and sent, including on the retry.
+        raw, body, encoding_headers = _encode_json_body(payload, self.gzip_requests)
         for attempt in range(2):
             if not self.access_token:
                 logger.warning(f"OpsRamp access token missing. Attempting to acquire (Attempt {attempt + 1}/2)...")
@@ -86,40 +245,13 @@ class OpsRampConnector:
                     logger.error("Failed to refresh OpsRamp token. Aborting send.")
                     return {"status": "error", "message": "Authentication failed"}
 
-            log_level_upper = log_level.upper()
-            priority_map = {"CRITICAL": "P1", "ERROR": "P2", "WARN": "P3", "INFO": "P5", "SUCCESS": "P5"}
-            state_map = {"CRITICAL": "CRITICAL", "ERROR": "CRITICAL", "WARN": "WARNING", "INFO": "OK", "SUCCESS": "OK"}
-            current_state = state_map.get(log_level_upper, "OK")
-            description_lines = [f"{message}", "", "Details:"]
-            if details:
-                for key, value in details.items():
-                    value_str = json.dumps(value) if isinstance(value, (dict, list)) else str(value)
-                    description_lines.append(f"- {key}: {value_str}")
-            description = "\n".join(description_lines)
-            
-            # --- START OF FIX ---
-            # Generate a short unique ID to prepend to the subject line.
-            # This is the most reliable way to prevent alert de-duplication.
-            short_unique_id = str(uuid.uuid4()).split('-')[0]
-            subject = f"[{short_unique_id}] AI Agent Log ({current_state}): {message[:110]}"
-            # --- END OF FIX ---
-
-            alert_object = {
-                "subject": subject,
-                "currentState": current_state,
-                "priority": priority_map.get(log_level_upper, "P5"),
-                "description": description,
-                "customFields": [], # Custom fields are not needed for this fix
-                "device": {"resourceUUID": self.turbine_resource_id},
-                "app": "Custom",
-                "serviceName": asset_id
-            }
-            payload = [alert_object]
-            headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json", "Accept": "application/json"}
+            headers = {"Authorization": f"Bearer {self.access_token}", "Content-Type": "application/json", "Accept": "application/json", **encoding_headers}
 
             try:
-                logger.info(f"Sending alert to OpsRamp with payload: {json.dumps(payload)}")
-                response = requests.post(self.alert_url, headers=headers, json=payload, timeout=20)
+                logger.info(f"Sending {len(payload)} alert(s) to OpsRamp ({len(raw)} bytes).")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"OpsRamp alert payload: {truncate_for_log(raw, 2000)}")
+                response = self.session.post(self.alert_url, headers=headers, data=body, timeout=OPSRAMP_TIMEOUT)
                 response.raise_for_status()
                 logger.info(f"Successfully sent alert to OpsRamp. Status: {response.status_code}")
                 return {"status": "success"}
@@ -132,7 +264,7 @@ class OpsRampConnector:
                 else:
                     return {"status": "error", "message": f"HTTP Error: {e.response.status_code}"}
             except requests.exceptions.RequestException as e:
-                logger.error(f"Error sending alert to OpsRamp: {e}", exc_info=True)
+                logger.error(f"Error sending alert to OpsRamp: {type(e).__name__}: {e}")
                 return {"status": "error", "message": str(e)}
         
         logger.error("Failed to send alert to OpsRamp after all retry attempts.")
@@ -156,16 +288,24 @@ class ServiceNowConnector:
         self.target_table = servicenow_config.get("target_table", "incident")
         self.api_base_url = f"https://{self.instance_hostname}/api/now/table/{self.target_table}"
         self.custom_fields_map = servicenow_config.get("custom_fields", {})
+        # Only enable if the instance accepts gzip-encoded request bodies.
+        self.gzip_requests = bool(servicenow_config.get("gzip_requests", False))
         
         self.session = requests.Session()
         retries = Retry(
             total=3, backoff_factor=1, 
             status_forcelist=[500, 502, 503, 504],
-            allowed_methods={"POST"}
+            allowed_methods={"POST", "PATCH"}
         )
-        self.session.mount('https://', HTTPAdapter(max_retries=retries))
+        self.session.mount('https://', _pooled_adapter(max_retries=retries))
         self.session.auth = HTTPBasicAuth(self.api_user, self.api_password)
-        self.session.headers.update({"Content-Type": "application/json", "Accept": "application/json"})
+        self.session.headers.update({"Content-Type": "application/json", "Accept": "application/json", "Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
+        # Work notes append, so a PATCH that ServiceNow applied but answered with 5xx must not be resent.
+        # Their session only retries failed connections, where the request never reached the instance.
+        self.note_session = requests.Session()
+        self.note_session.mount('https://', _pooled_adapter(max_retries=Retry(total=3, connect=3, read=0, status=0, backoff_factor=1, allowed_methods={"PATCH"})))
+        self.note_session.auth = self.session.auth
+        self.note_session.headers.update(self.session.headers)
         
         logger.info(f"ServiceNowConnector initialized for instance: https://{self.instance_hostname}. API User: {'SET' if self.api_user else 'NOT SET'}. Retry mechanism is active.")
 
@@ -177,14 +317,12 @@ class ServiceNowConnector:
         priority_map = {"HIGH": "1", "MEDIUM": "2", "LOW": "3"}; sn_priority = priority_map.get(priority.upper(), "2")
         payload = {"short_description": short_description, "description": description, "priority": sn_priority, "assignment_group": {"display_value": assignment_group}, "cmdb_ci": {"display_value": asset_id}, "caller_id": self.api_user, "contact_type": "Integration", "impact": sn_priority, "urgency": sn_priority}
         if self.custom_fields_map.get("source_system"): payload[self.custom_fields_map["source_system"]] = "HPE PCAI Predictive Maintenance Agent"
-        if ai_confidence is not None and self.custom_fields_map.get("ai_diagnosis_confidence"): payload[self.custom_fields_map["ai_diagnosis_confidence"]] = f"{ai_confidence*100:.1f}%"
-        if ai_reasoning and self.custom_fields_map.get("ai_reasoning"): payload[self.custom_fields_map["ai_reasoning"]] = ai_reasoning
-        if ai_recommended_actions and self.custom_fields_map.get("recommended_actions"): payload[self.custom_fields_map["recommended_actions"]] = "\n- ".join(ai_recommended_actions) 
-        if recommended_parts and self.custom_fields_map.get("required_parts"): payload[self.custom_fields_map["required_parts"]] = ", ".join(recommended_parts if recommended_parts else ["N/A"])
+        payload.update(self._ai_fields(ai_confidence, ai_reasoning, ai_recommended_actions, recommended_parts))
         
         logger.info(f"Attempting to create ticket in ServiceNow: {short_description[:60]}...");
         try:
-            response = self.session.post(self.api_base_url, json=payload, timeout=60)
+            _, body, encoding_headers = _encode_json_body(payload, self.gzip_requests)
+            response = self.session.post(self.api_base_url, data=body, headers=encoding_headers, timeout=SERVICENOW_TIMEOUT)
             logger.info(f"ServiceNow API raw response status: {response.status_code}");
             response.raise_for_status()
             response_json = response.json()
@@ -197,22 +335,166 @@ class ServiceNowConnector:
             logger.error(f"ServiceNow API call failed. {error_details}")
             return {"status": "error", "message": error_details, "work_order_id": None}
         except requests.exceptions.RequestException as e:
-            logger.error(f"ServiceNow API call failed after retries: {e}", exc_info=True)
+            logger.error(f"ServiceNow API call failed after retries: {type(e).__name__}: {e}")
             return {"status": "error", "message": str(e), "work_order_id": None}
 
+    def update_work_order(self, sys_id: str, description: str = None, recommended_parts: list = None, ai_confidence: float = None, ai_reasoning: str = None, ai_recommended_actions: list = None) -> dict:
+        """Fills in fields of an existing ticket (e.g. one created before the full AI diagnosis was available)."""
+        if not self.api_user or not self.api_password:
+            error_msg = "ServiceNow API credentials not configured. Cannot update ticket."; logger.error(error_msg)
+            return {"status": "error", "message": error_msg}
+
+        payload = self._ai_fields(ai_confidence, ai_reasoning, ai_recommended_actions, recommended_parts)
+        if description: payload["description"] = description
+
+        logger.info(f"Attempting to update ServiceNow ticket (Sys ID: {sys_id})...")
+        try:
+            _, body, encoding_headers = _encode_json_body(payload, self.gzip_requests)
+            response = self.session.patch(f"{self.api_base_url}/{sys_id}", data=body, headers=encoding_headers, timeout=SERVICENOW_TIMEOUT)
+            response.raise_for_status()
+            logger.info(f"Successfully updated ServiceNow ticket (Sys ID: {sys_id})")
+            return {"status": "success", "sys_id": sys_id}
+        except requests.exceptions.HTTPError as e:
+            error_details = f"HTTP Error: {e.response.status_code} - {e.response.text[:500]}"
+            logger.error(f"ServiceNow update failed. {error_details}")
+            return {"status": "error", "message": error_details}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"ServiceNow update failed after retries: {type(e).__name__}: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def append_work_note(self, sys_id: str, note: str) -> dict:
+        """Adds a work note to an existing ticket."""
+        if not self.api_user or not self.api_password:
+            error_msg = "ServiceNow API credentials not configured. Cannot add work note."; logger.error(error_msg)
+            return {"status": "error", "message": error_msg}
+        try:
+            _, body, encoding_headers = _encode_json_body({"work_notes": note}, self.gzip_requests)
+            response = self.note_session.patch(f"{self.api_base_url}/{sys_id}", data=body, headers=encoding_headers, timeout=SERVICENOW_TIMEOUT)
+            response.raise_for_status()
+            logger.info(f"Added work note to ServiceNow ticket (Sys ID: {sys_id})")
+            return {"status": "success", "sys_id": sys_id}
+        except requests.exceptions.HTTPError as e:
+            error_details = f"HTTP Error: {e.response.status_code} - {e.response.text[:500]}"
+            logger.error(f"ServiceNow work note failed. {error_details}")
+            return {"status": "error", "message": error_details}
+        except requests.exceptions.RequestException as e:
+            logger.error(f"ServiceNow work note failed after retries: {type(e).__name__}: {e}")
+            return {"status": "error", "message": str(e)}
+
+    def _ai_fields(self, ai_confidence: float = None, ai_reasoning: str = None, ai_recommended_actions: list = None, recommended_parts: list = None) -> dict:
+        fields = {}
+        if ai_confidence is not None and self.custom_fields_map.get("ai_diagnosis_confidence"): fields[self.custom_fields_map["ai_diagnosis_confidence"]] = f"{ai_confidence*100:.1f}%"
+        if ai_reasoning and self.custom_fields_map.get("ai_reasoning"): fields[self.custom_fields_map["ai_reasoning"]] = ai_reasoning
+        if ai_recommended_actions and self.custom_fields_map.get("recommended_actions"): fields[self.custom_fields_map["recommended_actions"]] = "\n- ".join(ai_recommended_actions) 
+        if recommended_parts and self.custom_fields_map.get("required_parts"): fields[self.custom_fields_map["required_parts"]] = ", ".join(recommended_parts if recommended_parts else ["N/A"])
+        return fields
+
+
+class _JsonObjectTracker:
+    """
+    Accumulates streamed text and detects when the first top-level JSON object has been closed.
+    Also records where each top-level member ends, so the members received so far can be parsed early.
+    """
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+        self._depth = 0
+        self._brackets = 0
+        self._in_string = False
+        self._escaped = False
+        self._end = None
+        self.member_ends = []
+        self.partial_reported = False
+
+    def feed(self, piece: str) -> bool:
+        offset = self._length
+        self._parts.append(piece)
+        self._length += len(piece)
+        for i, ch in enumerate(piece):
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch == '{':
+                self._depth += 1
+            elif ch == '[':
+                self._brackets += 1
+            elif ch == ']' and self._brackets > 0:
+                self._brackets -= 1
+            elif ch == ',' and self._depth == 1 and self._brackets == 0:
+                self.member_ends.append(offset + i)
+            elif ch == '}' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = offset + i + 1
+                    return True
+        return False
+
+    def text(self) -> str:
+        text = "".join(self._parts)
+        return text[:self._end] if self._end is not None else text
+
+    def completed_members(self) -> dict:
+        """Parses the top-level members that are complete so far; empty if none are (or they do not parse)."""
+        if not self.member_ends:
+            return {}
+        text = "".join(self._parts)
+        start = text.find("{")
+        try:
+            members = json.loads(text[start:self.member_ends[-1]] + "}")
+        except ValueError:
+            return {}
+        return members if isinstance(members, dict) else {}
+
 
 class OllamaConnector:
     def __init__(self, ollama_config: dict):
         self.model_name = ollama_config.get("model_name", "llama3:8b")
+        # Optional quantization tag suffix (e.g. "q4_K_M", "q8_0") selecting a quantized build of the model.
+        self.quantization = ollama_config.get("quantization") or None
+        if self.quantization and not self.model_name.endswith(f"-{self.quantization}"):
+            self.model_name = f"{self.model_name}-{self.quantization}"
         self.api_base_url = ollama_config.get("api_base_url", "http://localhost:11434")
         self.request_timeout = int(ollama_config.get("request_timeout_seconds", 180))
+        # Stream tokens and stop reading once the JSON object is complete, instead of waiting for the full completion.
+        self.stream_response = bool(ollama_config.get("stream_response", True))
+        self.generate_options = {"temperature": 0.2, "num_predict": 1024}
+        if ollama_config.get("num_ctx"):
+            self.generate_options["num_ctx"] = int(ollama_config["num_ctx"])
+        # How long Ollama keeps the model (and its evaluated system prompt) loaded between triggers.
+        self.keep_alive = ollama_config.get("keep_alive", "30m")
+        # HTTP/2 is only negotiated over TLS (e.g. Ollama behind an https proxy) and needs the 'h2' package.
+        self.http2 = bool(ollama_config.get("http2", False))
+        if self.http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("Ollama http2 requested but the 'h2' package is not installed (pip install 'httpx[http2]'). Using HTTP/1.1.")
+                self.http2 = False
+        self.http_limits = httpx.Limits(max_keepalive_connections=40, max_connections=100, keepalive_expiry=30.0)
         
         self.client = None
-        self.max_retries = 5
-        self.retry_delay_seconds = 15
+        # Connection failures are retried with exponential backoff; 4xx answers (auth, unknown model) are not.
+        self.max_retries = int(ollama_config.get("connect_retries", 2))
+        self.retry_delay_seconds = float(ollama_config.get("connect_retry_delay_seconds", 2))
+        # After Ollama is found unusable, calls fail immediately for this long instead of stalling every trigger.
+        self.circuit_open_seconds = float(ollama_config.get("circuit_open_seconds", 30))
+        self._circuit_open_until = 0.0
         logger.info(f"OllamaConnector configured for model '{self.model_name}'. Connection will be established on first use.")
 
+    def _open_circuit(self, reason: str):
+        self._circuit_open_until = time.monotonic() + self.circuit_open_seconds
+        logger.error(f"Ollama unavailable ({reason}). Skipping LLM calls for {self.circuit_open_seconds:.0f}s.")
+
     def _get_client(self):
+        if time.monotonic() < self._circuit_open_until:
+            logger.warning("Ollama marked unavailable after a recent failure. Not attempting to connect.")
+            return None
         if self.client:
             try:
                 self.client.list()
@@ -224,23 +506,90 @@ class OllamaConnector:
         for attempt in range(self.max_retries):
             try:
                 logger.info(f"Attempting to connect to Ollama at {self.api_base_url} (Attempt {attempt + 1}/{self.max_retries})...")
-                client_instance = ollama.Client(host=self.api_base_url, timeout=self.request_timeout)
+                client_instance = ollama.Client(host=self.api_base_url, timeout=self.request_timeout, limits=self.http_limits, http2=self.http2)
                 client_instance.list()
                 logger.info("Successfully connected to Ollama.")
                 self.client = client_instance
                 return self.client
+            except ollama.ResponseError as e:
+                if 400 <= e.status_code < 500:
+                    self._open_circuit(f"HTTP {e.status_code}: {e.error}")
+                    return None
+                logger.warning(f"Ollama connection attempt failed: {e}")
             except Exception as e:
                 logger.warning(f"Ollama connection attempt failed: {e}")
-                if attempt < self.max_retries - 1:
-                    logger.info(f"Retrying in {self.retry_delay_seconds} seconds...")
-                    time.sleep(self.retry_delay_seconds)
-                else:
-                    logger.error("All retry attempts to connect to Ollama have failed.")
-                    return None
+            if attempt < self.max_retries - 1:
+                delay = self.retry_delay_seconds * (2 ** attempt)
+                logger.info(f"Retrying in {delay:g} seconds...")
+                time.sleep(delay)
+        self._open_circuit("all connection attempts failed")
         return None
 
-    def generate_structured_diagnosis(self, prompt: str) -> dict:
+    def _generate_args(self, prompt: str, system: str = None) -> dict:
+        return {"model": self.model_name, "prompt": prompt, "system": system or "", "format": "json",
+                "options": self.generate_options, "keep_alive": self.keep_alive}
+
+    def _generate_text(self, client, prompt: str, system: str = None, on_partial=None) -> str:
+        if self.stream_response:
+            tracker = _JsonObjectTracker()
+            try:
+                return self._generate_streaming(client, prompt, system, tracker, on_partial)
+            except (ollama.ResponseError, httpx.TransportError):
+                # Server or network failures would just repeat on the buffered request.
+                raise
+            except Exception as e:
+                if tracker.partial_reported:
+                    # The caller already acted on part of this response; a fresh generation could contradict it.
+                    raise
+                logger.warning(f"Streaming generation from Ollama failed ({e}). Falling back to a buffered request.")
+        response = client.generate(**self._generate_args(prompt, system))
+        return response.get('response', '{}')
+
+    def _generate_streaming(self, client, prompt: str, system: str, tracker: "_JsonObjectTracker", on_partial=None) -> str:
+        """
+        Streams the completion and stops reading as soon as the first top-level JSON object is closed.
+        Closing the stream early drops the HTTP connection, which makes Ollama cancel the remaining generation.
+        If given, `on_partial(members)` is called with the parsed members each time another top-level member completes.
+        """
+        stream = client.generate(**self._generate_args(prompt, system), stream=True)
+        members_seen = 0
+        try:
+            for chunk in stream:
+                if tracker.feed(chunk.get('response', '')):
+                    logger.info("Complete JSON object received from Ollama stream. Stopping generation early.")
+                    break
+                if chunk.get('done'):
+                    break
+                if on_partial and len(tracker.member_ends) > members_seen:
+                    members_seen = len(tracker.member_ends)
+                    members = tracker.completed_members()
+                    if members:
+                        tracker.partial_reported = True
+                        on_partial(members)
+        finally:
+            stream.close()
+        return tracker.text() or '{}'
+
+    def warm_up(self, system: str = None) -> bool:
+        """Loads the model into Ollama and evaluates the system prompt once, so the first real diagnosis starts warm."""
         client = self._get_client()
+        if not client:
+            return False
+        try:
+            args = self._generate_args("Reply with an empty JSON object.", system)
+            args["options"] = {**self.generate_options, "num_predict": 1}
+            client.generate(**args)
+            return True
+        except Exception as e:
+            logger.warning(f"Ollama warm-up request failed: {e}")
+            return False
+
+    def connect_async(self, executor):
+        """Starts the Ollama connection check on `executor` so it can overlap other work; pass the result to generate_structured_diagnosis()."""
+        return executor.submit(self._get_client)
+
+    def generate_structured_diagnosis(self, prompt: str, system: str = None, client_future=None, on_partial=None) -> dict:
+        client = client_future.result() if client_future else self._get_client()
         if not client:
             logger.error("Ollama client not available. Cannot generate diagnosis.")
             return {"error": "Ollama client not available", "raw_output": ""}
@@ -248,18 +597,24 @@ class OllamaConnector:
         logger.info(f"Sending prompt to Ollama model: {self.model_name} (Prompt length: {len(prompt)} chars)")
         llm_output_str = ""
         try:
-            response = client.generate(model=self.model_name, prompt=prompt, format="json", options={"temperature": 0.2, "num_predict": 1024})
-            llm_output_str = response.get('response', '{}')
-            logger.debug(f"Ollama raw JSON string response: {llm_output_str}")
-            parsed_response = json.loads(llm_output_str)
+            llm_output_str = self._generate_text(client, prompt, system, on_partial)
+            logger.debug("Ollama raw JSON string response: %s", llm_output_str)
+            parsed_response = orjson.loads(llm_output_str)
             logger.info("Successfully parsed JSON response from Ollama.")
             return parsed_response
         except json.JSONDecodeError as e:
-            logger.error(f"Ollama response was not valid JSON: {e}. Raw output (first 500 chars): '{llm_output_str[:500]}'")
+            logger.error(f"Ollama response was not valid JSON: {e}. Raw output (first 500 chars): '{truncate_for_log(llm_output_str, 500)}'")
             return {"error": "Failed to parse LLM JSON response", "raw_output": llm_output_str}
         except ollama.ResponseError as e:
             logger.error(f"Ollama API ResponseError: STATUS={e.status_code}, ERROR='{e.error}'. Model: {self.model_name}")
+            if 400 <= e.status_code < 500:
+                # e.g. model not pulled: every following call would fail the same way.
+                self._open_circuit(f"HTTP {e.status_code}: {e.error}")
             return {"error": f"Ollama API ResponseError: {e.error}", "status_code": e.status_code, "raw_output": ""}
+        except httpx.TransportError as e:
+            # Connection failures and timeouts are expected operating conditions; no traceback needed.
+            logger.error(f"Ollama API call failed: {type(e).__name__}: {e}")
+            return {"error": f"Ollama API call failed: {str(e)}", "raw_output": ""}
         except Exception as e:
             logger.error(f"Exception during Ollama API call: {e}", exc_info=True)
             return {"error": f"Ollama API call failed: {str(e)}", "raw_output": ""}
\ No newline at end of file
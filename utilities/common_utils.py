@@ -1,8 +1,11 @@
 # utilities/common_utils.py
 
 import datetime
+import json
 import yaml
 import os
+import time
+import threading
 import logging # Using standard logging for utilities
 
 # Configure a basic logger for utility functions
@@ -12,6 +15,11 @@ logger = logging.getLogger(__name__)
 # For example: logging.basicConfig(level=logging.INFO) in your main script.
 
 
+# libyaml's C loader when PyYAML was built with it; same safe semantics as yaml.safe_load.
+_YAML_SAFE_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+# (epoch second, "YYYY-MM-DDTHH:MM:SS") of the last timestamp, reused until the second changes.
+_TIMESTAMP_SECOND = (None, "")
+
 def get_utc_timestamp(timespec: str = 'milliseconds') -> str:
     """
     Generates a standardized UTC timestamp string in ISO 8601 format.
@@ -23,56 +31,86 @@ def get_utc_timestamp(timespec: str = 'milliseconds') -> str:
     Returns:
         str: ISO 8601 formatted UTC timestamp string ending with 'Z'.
     """
-    return datetime.datetime.utcnow().isoformat(timespec=timespec) + "Z"
+    global _TIMESTAMP_SECOND
+    ns = time.time_ns()
+    seconds, remainder_ns = divmod(ns, 1_000_000_000)
+    cached = _TIMESTAMP_SECOND
+    if cached[0] != seconds:
+        cached = (seconds, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(seconds)))
+        _TIMESTAMP_SECOND = cached # Swapped as one tuple, so concurrent callers never mix two seconds
+    if timespec == 'milliseconds':
+        return f"{cached[1]}.{remainder_ns // 1_000_000:03d}Z"
+    if timespec == 'microseconds':
+        return f"{cached[1]}.{remainder_ns // 1_000:06d}Z"
+    if timespec == 'seconds':
+        return cached[1] + "Z"
+    return datetime.datetime.fromtimestamp(ns / 1e9, datetime.timezone.utc).replace(tzinfo=None).isoformat(timespec=timespec) + "Z"
+
+
+def truncate_for_log(obj, limit: int = 1000) -> str:
+    """
+    Returns a bounded string form of `obj` for log messages.
+
+    Strings are sliced as-is, bytes are decoded as UTF-8; other objects are serialized
+    once with json.dumps (falling back to str() for non-JSON values). A trailing '…' marks a cut.
+    """
+    if isinstance(obj, bytes):
+        cut = len(obj) > limit
+        text = obj[:limit].decode("utf-8", errors="replace")
+        return text + "…" if cut else text
+    text = obj if isinstance(obj, str) else json.dumps(obj, default=str)
+    return text if len(text) <= limit else text[:limit] + "…"
+
 
+# Resolved config file path per (config_filename, base_search_path), so reloads skip the location probing.
+_RESOLVED_CONFIG_PATHS = {}
 
 def _find_config_file(config_filename="demo_config.yaml", base_search_path="config"):
     """
     Tries to find the configuration file by checking a few common locations
     relative to the current working directory or script locations.
+    A previously resolved path is reused as long as the file still exists there.
     """
+    cache_key = (config_filename, base_search_path)
+    cached_path = _RESOLVED_CONFIG_PATHS.get(cache_key)
+    if cached_path and os.path.exists(cached_path):
+        return cached_path
+
     # Path 1: Directly under base_search_path (e.g., project_root/config/demo_config.yaml)
-    path1 = os.path.join(base_search_path, config_filename)
-    if os.path.exists(path1):
-        return os.path.abspath(path1)
+    candidates = [os.path.join(base_search_path, config_filename)]
 
     # Path 2: Relative to a script that might be one level down (e.g., in src/ or pcai_app/)
     # ../config/demo_config.yaml
     try:
         script_dir = os.path.dirname(os.path.abspath(__file__)) # Dir of this utils.py file
-        path2 = os.path.join(script_dir, "..", base_search_path, config_filename)
-        if os.path.exists(path2):
-            return os.path.abspath(path2)
-        
-        # If utils is inside another folder (e.g. src/utilities)
-        path3 = os.path.join(script_dir, "..", "..", base_search_path, config_filename)
-        if os.path.exists(path3):
-            return os.path.abspath(path3)
-
+        candidates.append(os.path.join(script_dir, "..", base_search_path, config_filename))
+        # Path 3: If utils is inside another folder (e.g. src/utilities)
+        candidates.append(os.path.join(script_dir, "..", "..", base_search_path, config_filename))
     except NameError: # __file__ might not be defined in some execution contexts
         pass
 
     # Path 4: Current working directory (less ideal but a fallback)
-    path4 = os.path.join(os.getcwd(), config_filename)
-    if os.path.exists(path4):
-        return os.path.abspath(path4)
-        
+    candidates.append(os.path.join(os.getcwd(), config_filename))
     # Path 5: Directly in current working directory's config folder
-    path5 = os.path.join(os.getcwd(), base_search_path, config_filename)
-    if os.path.exists(path5):
-        return os.path.abspath(path5)
+    candidates.append(os.path.join(os.getcwd(), base_search_path, config_filename))
 
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            _RESOLVED_CONFIG_PATHS[cache_key] = os.path.abspath(candidate)
+            return _RESOLVED_CONFIG_PATHS[cache_key]
 
     logger.warning(f"Configuration file '{config_filename}' not found in standard search paths.")
     return None
 
 
 CONFIG_CACHE = None
+_CONFIG_LOCK = threading.Lock() # Serializes loading CONFIG_CACHE
 
 def get_full_config(config_filename="demo_config.yaml", config_base_dir="config", force_reload=False) -> dict:
     """
     Loads the entire YAML configuration file.
-    Caches the loaded configuration to avoid redundant file I/O unless force_reload is True.
+    Caches the loaded configuration to avoid redundant file I/O unless force_reload is True;
+    concurrent first calls parse the file only once.
 
     Args:
         config_filename (str): The name of the configuration file.
@@ -87,25 +125,30 @@ def get_full_config(config_filename="demo_config.yaml", config_base_dir="config"
         logger.debug("Returning cached full configuration.")
         return CONFIG_CACHE
 
-    effective_config_path = _find_config_file(config_filename, config_base_dir)
-    
-    if not effective_config_path:
-        logger.error(f"Critical: Full configuration file '{config_filename}' could not be found.")
-        return {} # Return empty dict if not found
+    # Double-checked: threads that found the cache empty wait here, and all but the first reuse its result.
+    with _CONFIG_LOCK:
+        if CONFIG_CACHE is not None and not force_reload:
+            return CONFIG_CACHE
 
-    try:
-        with open(effective_config_path, 'r') as f:
-            CONFIG_CACHE = yaml.safe_load(f)
-        logger.info(f"Successfully loaded full configuration from: {effective_config_path}")
-        return CONFIG_CACHE
-    except FileNotFoundError:
-        logger.error(f"Full configuration file not found at path: {effective_config_path}")
-    except yaml.YAMLError as e:
-        logger.error(f"Error parsing YAML in full configuration file {effective_config_path}: {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error loading full configuration from {effective_config_path}: {e}")
+        effective_config_path = _find_config_file(config_filename, config_base_dir)
+    
+        if not effective_config_path:
+            logger.error(f"Critical: Full configuration file '{config_filename}' could not be found.")
+            return {} # Return empty dict if not found
+
+        try:
+            with open(effective_config_path, 'rb') as f: # libyaml detects the encoding from the bytes
+                CONFIG_CACHE = yaml.load(f, Loader=_YAML_SAFE_LOADER)
+            logger.info(f"Successfully loaded full configuration from: {effective_config_path}")
+            return CONFIG_CACHE
+        except FileNotFoundError:
+            logger.error(f"Full configuration file not found at path: {effective_config_path}")
+        except yaml.YAMLError as e:
+            logger.error(f"Error parsing YAML in full configuration file {effective_config_path}: {e}")
+        except Exception as e:
+            logger.error(f"Unexpected error loading full configuration from {effective_config_path}: {e}")
     
-    return {} # Return empty in case of any error
+        return {} # Return empty in case of any error
 
 
 def load_app_config(config_section_name: str, 